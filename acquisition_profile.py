@@ -0,0 +1,288 @@
+"""
+Acquisition profiles: which sensors are read with which settings, over which transport, and where the
+samples go. A profile is a JSON (or, on Python 3.11+, TOML) file that is loaded and validated once at
+startup. Missing entries take the values of DEFAULT_PROFILE, which matches what used to be hard-coded.
+"""
+
+import copy
+
+from sample_block import SENSOR_NAMES
+
+DEFAULT_PROFILE = {
+    'name': 'default',
+    'transport': {'type': 'i2c', 'port': 1},
+    'schedule': ['acc'],
+    'block_size': 64,
+    # maximum number of queued blocks per writer, 0 is unbounded
+    'queue_size': 0,
+    # what happens when a writer falls behind, see flow_control
+    'flow_control': {'policy': 'drop_oldest', 'max_queued': 256, 'recover_after': 5},
+    # anomaly detection on the accelerometer samples, see anomaly_detector
+    'anomaly': {'enabled': False, 'window': 256, 'alpha': 0.01, 'window_alpha': 0.05, 'threshold': 6.0,
+                'window_threshold': 4.0, 'bands': 16, 'warmup': 20, 'forward': 'all', 'alerts_path': None},
+    'sensors': {
+        'acc': {'backend': 'i2c', 'alternate_address': True, 'rate': 800, 'range': 16,
+                'full_resolution': True, 'low_power': False, 'spi_bus': 0, 'spi_device': 0},
+        'gyr': {'address': 0x68, 'lpf': 0, 'divider': 8},
+        'comp': {'address': 0x1E, 'gauss': 1.3, 'rate': 15, 'samples': 8, 'declination': [0, 0]},
+    },
+    'writers': [{'type': 'file', 'path': '/home/pi/sensor_recordings/', 'index_interval': 1024}],
+}
+
+# Shorthands for the schedule
+SCHEDULES = {
+    'acc': ['acc'],
+    'full': ['gyr', 'acc', 'acc', 'acc', 'acc', 'acc', 'comp', 'acc',
+             'acc', 'acc', 'acc', 'gyr', 'acc', 'acc', 'acc', 'acc'],
+}
+
+ACC_BACKENDS = ('i2c', 'spi')
+TRANSPORTS = ('i2c', 'simulated')
+WRITERS = ('file', 'stdout')
+# entries each writer type accepts
+WRITER_KEYS = {'file': ('type', 'path', 'index_interval'), 'stdout': ('type', 'nth')}
+FLOW_POLICIES = ('none', 'drop_oldest', 'decimate', 'rate')
+ANOMALY_FORWARD = ('all', 'alerts')
+
+
+class AcquisitionProfile:
+    """
+    Validated profile with the derived constants (scale factors, output data rates, sample periods)
+    computed once, by the same driver code that configures the devices
+    """
+
+    def __init__(self, config):
+        """
+
+        :param config: Profile as a dict, merged over DEFAULT_PROFILE
+        :raises ValueError: If the profile is invalid
+        """
+        if not isinstance(config, dict):
+            raise ValueError("invalid profile [" + str(config) + "] expected an object")
+        config = _merge(copy.deepcopy(DEFAULT_PROFILE), config)
+        self.config = config
+        if not isinstance(config['name'], str):
+            raise ValueError("invalid name [" + str(config['name']) + "] expected a string")
+        self.name = config['name']
+
+        transport = config['transport']
+        _one_of(transport['type'], 'transport.type', TRANSPORTS)
+        self.transport = transport['type']
+        self.port = _int(transport, 'port', 'transport.port', 0)
+
+        schedule = config['schedule']
+        if isinstance(schedule, str):
+            _one_of(schedule, 'schedule', sorted(SCHEDULES))
+            schedule = SCHEDULES[schedule]
+        if not isinstance(schedule, list) or not schedule:
+            raise ValueError("invalid schedule [" + str(schedule) + "] expected a list of at least one sensor or "
+                             "one of " + str(sorted(SCHEDULES)))
+        for sensor in schedule:
+            _one_of(sensor, 'schedule', SENSOR_NAMES[:3])
+        # sensor ids as used by SensorReader
+        self.schedule = tuple(SENSOR_NAMES.index(sensor) for sensor in schedule)
+        self.sensors = frozenset(schedule)
+
+        self.block_size = _int(config, 'block_size', 'block_size', 1)
+        self.queue_size = _int(config, 'queue_size', 'queue_size', 0)
+
+        flow_control = config['flow_control']
+        _one_of(flow_control['policy'], 'flow_control.policy', FLOW_POLICIES)
+        if flow_control['policy'] == 'rate' and 'acc' not in self.sensors:
+            raise ValueError("invalid flow_control.policy [rate] expected acc in the schedule")
+        self.flow_policy = flow_control['policy']
+        self.max_queued = _int(flow_control, 'max_queued', 'flow_control.max_queued', 2)
+        self.recover_after = _int(flow_control, 'recover_after', 'flow_control.recover_after', 1)
+
+        self.anomaly = config['anomaly']
+        if _bool(self.anomaly, 'enabled', 'anomaly.enabled'):
+            self._init_anomaly(self.anomaly)
+
+        # settings of sensors that are not read are neither validated nor their drivers imported
+        self.acc = config['sensors']['acc']
+        self.gyr = config['sensors']['gyr']
+        self.comp = config['sensors']['comp']
+        self.acc_rate = self.acc_period_ms = self.acc_scale = None
+        self.gyr_rate = self.gyr_period_ms = self.gyr_scale = None
+        self.comp_rate = self.comp_period_ms = self.comp_scale = None
+        if 'acc' in self.sensors:
+            self._init_accelerometer(self.acc)
+        if 'gyr' in self.sensors:
+            self._init_gyroscope(self.gyr)
+        if 'comp' in self.sensors:
+            self._init_compass(self.comp)
+
+        self.writers = config['writers']
+        if not isinstance(self.writers, list) or not self.writers:
+            raise ValueError("invalid writers [" + str(self.writers) + "] expected a list of at least one writer")
+        for writer in self.writers:
+            if not isinstance(writer, dict):
+                raise ValueError("invalid writers entry [" + str(writer) + "] expected an object")
+            _one_of(writer.get('type'), 'writers.type', WRITERS)
+            for key in writer:
+                _one_of(key, 'writers entry of type ' + writer['type'], WRITER_KEYS[writer['type']])
+            if writer['type'] == 'stdout':
+                _int(writer, 'nth', 'writers.nth', 1, default=1)
+            else:
+                _int(writer, 'index_interval', 'writers.index_interval', 1, default=1024)
+                if not writer.get('path') or not isinstance(writer['path'], str):
+                    raise ValueError("invalid writers.path [" + str(writer.get('path')) + "]")
+        if self.flow_policy == 'rate' and len(self.writers) > 1:
+            # every writer would get its own FlowControl, and they would all change the one rate
+            raise ValueError("invalid flow_control.policy [rate] expected a single writer")
+
+    def _init_accelerometer(self, acc):
+        from adxl345.base import ADXL345_Base
+        _one_of(acc['backend'], 'sensors.acc.backend', ACC_BACKENDS)
+        _one_of(acc['range'], 'sensors.acc.range', ADXL345_Base.RANGES)
+        _number(acc, 'rate', 'sensors.acc.rate', 0)
+        for key in ('alternate_address', 'full_resolution', 'low_power'):
+            _bool(acc, key, 'sensors.acc.' + key)
+        if acc['backend'] == 'spi':
+            _int(acc, 'spi_bus', 'sensors.acc.spi_bus', 0)
+            _int(acc, 'spi_device', 'sensors.acc.spi_device', 0)
+        # the device uses the next lower supported rate
+        (self.acc_rate, rate_code) = ADXL345_Base.data_rate_code(acc['rate'])
+        self.acc_period_ms = 1000.0 / self.acc_rate
+        self.acc_scale = ADXL345_Base.scale_factor(acc['range'], acc['full_resolution'])
+
+    def _init_gyroscope(self, gyr):
+        from itg3200.ITG3200 import ITG3200
+        _int(gyr, 'lpf', 'sensors.gyr.lpf', 0, 6)
+        _int(gyr, 'divider', 'sensors.gyr.divider', 1, 0xff)
+        _int(gyr, 'address', 'sensors.gyr.address', 0, 0x7f)
+        self.gyr_rate = ITG3200.output_rate(gyr['lpf'], gyr['divider'])
+        self.gyr_period_ms = 1000.0 / self.gyr_rate
+        self.gyr_scale = 1 / ITG3200.LSB_PER_DPS
+
+    def _init_compass(self, comp):
+        from hmc5883l.HMC5883L import HMC5883L
+        _one_of(comp['gauss'], 'sensors.comp.gauss', HMC5883L.scales)
+        _one_of(comp['rate'], 'sensors.comp.rate', HMC5883L.rates)
+        _one_of(comp['samples'], 'sensors.comp.samples', HMC5883L.averaged_samples)
+        _int(comp, 'address', 'sensors.comp.address', 0, 0x7f)
+        declination = comp['declination']
+        if not isinstance(declination, list) or len(declination) != 2 or \
+                not all(_is_number(value) for value in declination):
+            raise ValueError("invalid sensors.comp.declination [" + str(comp['declination']) +
+                             "] expected [degrees, minutes]")
+        self.comp_rate = float(comp['rate'])
+        self.comp_period_ms = 1000.0 / self.comp_rate
+        # mG per LSB
+        self.comp_scale = HMC5883L.scales[comp['gauss']]
+
+    def _init_anomaly(self, anomaly):
+        if 'acc' not in self.sensors:
+            raise ValueError("invalid anomaly.enabled [True] expected acc in the schedule")
+        bands = _int(anomaly, 'bands', 'anomaly.bands', 1)
+        _int(anomaly, 'window', 'anomaly.window', 2 * bands + 2)
+        _int(anomaly, 'warmup', 'anomaly.warmup', 0)
+        for key in ('alpha', 'window_alpha'):
+            _number(anomaly, key, 'anomaly.' + key, 0, 1)
+        for key in ('threshold', 'window_threshold'):
+            _number(anomaly, key, 'anomaly.' + key, 0)
+        if anomaly['alerts_path'] is not None and not isinstance(anomaly['alerts_path'], str):
+            raise ValueError("invalid anomaly.alerts_path [" + str(anomaly['alerts_path']) + "] expected a path")
+        _one_of(anomaly['forward'], 'anomaly.forward', ANOMALY_FORWARD)
+
+    def describe(self):
+        """
+        :return: Human readable summary of the profile and its derived constants
+        """
+        lines = ['Profile ' + self.name + ' (' + self.transport + ', schedule: ' +
+                 ','.join(SENSOR_NAMES[sensor] for sensor in self.schedule) + ')']
+        if 'acc' in self.sensors:
+            lines.append('  acc: ' + str(self.acc_rate) + ' Hz, +-' + str(self.acc['range']) + ' g, ' +
+                         str(self.acc_scale) + ' g/LSB')
+        if 'gyr' in self.sensors:
+            lines.append('  gyr: ' + str(self.gyr_rate) + ' Hz, ' + str(self.gyr_scale) + ' deg/s/LSB')
+        if 'comp' in self.sensors:
+            lines.append('  comp: ' + str(self.comp_rate) + ' Hz, ' + str(self.comp_scale) + ' mG/LSB')
+        if self.anomaly['enabled']:
+            lines.append('  anomaly detection: ' + str(self.anomaly['window']) + ' sample windows, ' +
+                         str(self.anomaly['bands']) + ' bands, forwarding ' + self.anomaly['forward'])
+        if self.flow_policy != 'none':
+            lines.append('  flow control: ' + self.flow_policy + ' (max ' + str(self.max_queued) + ' queued blocks)')
+        return '\n'.join(lines)
+
+
+def _merge(base, override, prefix=''):
+    for key, value in override.items():
+        if key not in base:
+            # most likely a typo, which would otherwise silently fall back to the default
+            raise ValueError("unknown profile entry [" + prefix + key + "]")
+        if isinstance(base[key], dict):
+            if not isinstance(value, dict):
+                raise ValueError("invalid " + prefix + key + " [" + str(value) + "] expected an object")
+            _merge(base[key], value, prefix + key + '.')
+        else:
+            base[key] = value
+    return base
+
+
+def _check(valid, name, value, expected):
+    if not valid:
+        raise ValueError("invalid " + name + " [" + str(value) + "] expected one of " + str(list(expected)))
+
+
+def _one_of(value, name, expected):
+    """
+    Checks that value is one of expected (a sequence, or a dict of which the keys are the valid values)
+    """
+    try:
+        valid = value in expected and not isinstance(value, bool)
+    except TypeError:
+        # unhashable, e.g. a list
+        valid = False
+    _check(valid, name, value, sorted(expected) if isinstance(expected, dict) else expected)
+    return value
+
+
+def _int(section, key, name, minimum, maximum=None, default=None):
+    value = section.get(key, default)
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum or \
+            (maximum is not None and value > maximum):
+        raise ValueError("invalid " + name + " [" + str(value) + "] expected an integer >= " + str(minimum) +
+                         ("" if maximum is None else " and <= " + str(maximum)))
+    return value
+
+
+def _number(section, key, name, minimum, maximum=None):
+    """
+    Checks for an int or float > minimum and, if given, < maximum
+    """
+    value = section[key]
+    if not _is_number(value) or not value > minimum or (maximum is not None and not value < maximum):
+        raise ValueError("invalid " + name + " [" + str(value) + "] expected a number > " + str(minimum) +
+                         ("" if maximum is None else " and < " + str(maximum)))
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _bool(section, key, name):
+    value = section[key]
+    if not isinstance(value, bool):
+        raise ValueError("invalid " + name + " [" + str(value) + "] expected true or false")
+    return value
+
+
+def load_profile(path=None):
+    """
+    Loads and validates a profile file (.json, or .toml on Python 3.11+)
+    :param path: None returns the default profile
+    :raises ValueError: If the profile is invalid
+    """
+    if path is None:
+        return AcquisitionProfile({})
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    else:
+        import json
+        with open(path) as f:
+            config = json.load(f)
+    return AcquisitionProfile(config)
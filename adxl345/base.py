@@ -46,6 +46,12 @@ class ADXL345_Base:
     # Full Resolution scale factor (0x100 LSB/g ~= 3.9/1000 mg/LSB)
     SCALE_FACTOR = 1 / 0x100
 
+    # range in g -> range code of DATA_FORMAT
+    RANGES = {2: 0x0, 4: 0x1, 8: 0x2, 16: 0x3}
+
+    # g per LSB for the current range/resolution, used by read_data_into
+    _scale = SCALE_FACTOR
+
     def __init__(self):
         self._full_resolution = True
         self._range = 0
@@ -62,7 +68,9 @@ class ADXL345_Base:
     def get_device_id(self):
         return self.get_register(ADXL345_Base.REG_DEVICE_ID)
 
-    def set_data_rate(self, hz, low_power=False):
+    @staticmethod
+    def data_rate_code(hz):
+        """ Returns the output data rate the device would use for the requested rate (the next lower supported rate) and its BW_RATE code """
         if hz >= 3200:
             rate = 3200
             rate_code = 0b1111
@@ -111,6 +119,10 @@ class ADXL345_Base:
         elif hz < 25 / 128:
             rate = 25 / 256
             rate_code = 0
+        return (rate, rate_code)
+
+    def set_data_rate(self, hz, low_power=False):
+        (rate, rate_code) = ADXL345_Base.data_rate_code(hz)
 
         if low_power:
             rate_code = rate_code | 0x10
@@ -125,7 +137,7 @@ class ADXL345_Base:
         """ Convert the gravity data returned by the ADXL to meaningful values """
         value = lsb | (msb << 8)
         if value & 0x8000:
-            value = -value ^ 0xFFFF
+            value -= 0x10000
         if not self._full_resolution:
             value = value << self._range
         value *= ADXL345_Base.SCALE_FACTOR
@@ -178,21 +190,21 @@ class ADXL345_Base:
 
     def set_range(self, range, full_resolution=True):
         """ Set the G range and the resolution. Valid range values are 2, 4, 8, 16. Full resolution set either 10-bit or 13-bit resolution """
-        if range == 2:
-            range_code = 0x0
-        elif range == 4:
-            range_code = 0x1
-        elif range == 8:
-            range_code = 0x2
-        elif range == 16:
-            range_code = 0x3
-        else:
-            raise ValueError("invalid range [" + str(range) + "] expected one of [2, 4, 8, 16]")
-
-        self._range = range_code
+        self._scale = ADXL345_Base.scale_factor(range, full_resolution)
+        self._range = ADXL345_Base.RANGES[range]
         self._full_resolution = full_resolution
         self._send_data_format()
 
+    @staticmethod
+    def scale_factor(range, full_resolution=True):
+        """ return the g per LSB for a G range and resolution, as set by set_range """
+        if range not in ADXL345_Base.RANGES:
+            raise ValueError("invalid range [" + str(range) + "] expected one of " +
+                             str(sorted(ADXL345_Base.RANGES)))
+        if full_resolution:
+            return ADXL345_Base.SCALE_FACTOR
+        return ADXL345_Base.SCALE_FACTOR * (1 << ADXL345_Base.RANGES[range])
+
     def read_data(self):
         """ return values for the 3 axes of the ADXL, expressed in g (multiple of earth gravity) """
         bytes = self.get_registers(ADXL345_Base.REG_DATAX0, 6)
@@ -201,6 +213,24 @@ class ADXL345_Base:
         z = self._convert(bytes[4], bytes[5])
         return (x, y, z)
 
+    def _read_registers_into(self, address, count):
+        """ Like get_registers, but subclasses may return a reused buffer instead of a new list """
+        return self.get_registers(address, count)
+
+    def read_data_into(self, out, offset=0):
+        """ Like read_data, but writes the values for the 3 axes to out[offset:offset + 3] without allocating
+        :return: out
+        """
+        bytes = self._read_registers_into(ADXL345_Base.REG_DATAX0, 6)
+        scale = self._scale
+        x = bytes[0] | (bytes[1] << 8)
+        y = bytes[2] | (bytes[3] << 8)
+        z = bytes[4] | (bytes[5] << 8)
+        out[offset] = (x - 0x10000 if x & 0x8000 else x) * scale
+        out[offset + 1] = (y - 0x10000 if y & 0x8000 else y) * scale
+        out[offset + 2] = (z - 0x10000 if z & 0x8000 else z) * scale
+        return out
+
     def get_fifo_count(self):
         count = self.get_register(ADXL345_Base.REG_FIFO_STATUS)
         return count & 0x7F
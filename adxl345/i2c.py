@@ -3,7 +3,6 @@ PYTHON driver for the ADXL-345 (3 axes accelerometer from Analog Device)
 This driver use the I2C protocol to communicate (see README)
 """
 
-import smbus
 import adxl345.base
 
 class ADXL345(adxl345.base.ADXL345_Base):
@@ -11,12 +10,19 @@ class ADXL345(adxl345.base.ADXL345_Base):
   STD_ADDRESS = 0x1D
   ALT_ADDRESS = 0x53
 
-  def __init__(self, alternate=False, port=1):
+  def __init__(self, alternate=False, port=1, bus=None):
     """ Initialize the driver
     :param alternate: use the standard or alternate I2C address as selected by pin SDO/ALT_ADDRESS
     :param port: number of I2C bus to use
+    :param bus: already opened bus object (e.g. a SimulatedBus). If None, smbus.SMBus(port) is opened
     """
-    self.bus = smbus.SMBus(port)
+    if bus is None:
+      import smbus
+      bus = smbus.SMBus(port)
+    self.bus = bus
+    # smbus2 buses support combined transactions into a buffer that can be reused for every read
+    self._use_rdwr = hasattr(bus, 'i2c_rdwr')
+    self._transfers = {}
     if alternate: 
       self.i2caddress = ADXL345.ALT_ADDRESS
     else:
@@ -33,3 +39,22 @@ class ADXL345(adxl345.base.ADXL345_Base):
   def set_register(self, address, value):
     self.bus.write_byte_data(self.i2caddress, address, value)
 
+  def _read_registers_into(self, address, count):
+    if not self._use_rdwr:
+      return self.bus.read_i2c_block_data(self.i2caddress, address, count)
+    transfer = self._transfers.get(address)
+    if transfer is None or len(transfer[2]) != count:
+      transfer = self._transfers[address] = self._new_transfer(address, count)
+    self.bus.i2c_rdwr(transfer[0], transfer[1])
+    return transfer[2]
+
+  def _new_transfer(self, address, count):
+    """ Prepares the messages to read count registers starting at address into a reusable bytearray """
+    import ctypes
+    from smbus2 import i2c_msg
+    buf = bytearray(count)
+    write = i2c_msg.write(self.i2caddress, [address])
+    read = i2c_msg.read(self.i2caddress, count)
+    # let the kernel write directly into buf instead of a new ctypes buffer
+    read.buf = ctypes.cast((ctypes.c_char * count).from_buffer(buf), ctypes.POINTER(ctypes.c_char))
+    return (write, read, buf)
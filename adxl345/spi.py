@@ -23,14 +23,14 @@ class ADXL345(adxl345.base.ADXL345_Base):
     self.spi.lsbfirst = False
 
   def get_register(self, address):
-    value = self.spi.xfer2( [ (address & 0x3F) | READ_MASK ] )
-    return value;
+    # the device clocks the value out in the byte after the address
+    value = self.spi.xfer2( [ (address & 0x3F) | READ_MASK, 0 ] )
+    return value[1]
 
   def get_registers(self, address, count):
-    self.spi.writebytes( [ address & 0x3F ] | READ_MASK | MULTIREAD_MASK )
-    value = self.spi.readbytes(count)
-    return value
+    # one transfer, chip select stays low while the device auto-increments the address
+    value = self.spi.xfer2( [ (address & 0x3F) | READ_MASK | MULTIREAD_MASK ] + [ 0 ] * count )
+    return value[1:]
 
   def set_register(self, address, value):
-    self.spi.writebytes( [ address, value ] )
-
+    self.spi.writebytes( [ (address & 0x3F) | WRITE_MASK, value ] )
@@ -0,0 +1,250 @@
+"""
+Anomaly detection on the accelerometer stream, on the device, vectorised with numpy.
+
+AnomalyDetector is a listener stage: it looks at every block and passes it on to the next listener. It keeps
+per axis
+- exponentially weighted mean and variance of the samples. Samples more than threshold standard deviations
+  away from the mean are out of the envelope.
+- features of non-overlapping windows of `window` samples: RMS, peak and kurtosis of the vibration (the
+  signal minus its mean in the window) and the power in `bands` equally wide frequency bands. Every feature
+  has an exponentially weighted baseline of its logarithm, a window whose feature is more than
+  window_threshold standard deviations above it is anomalous.
+The memory is constant: a window of samples and a few numbers per axis and feature, independent of how long
+the detector runs. A lasting change becomes the new baseline after about 1 / window_alpha windows.
+
+Alerts are written into the stream as 'alert' samples (x = kind, y = axis, z = score in standard deviations)
+and, if alerts_path is given, as lines of a CSV file. For the kinds see KIND_NAMES, band b has the kind
+KIND_BAND + b. A block reports at most one out-of-envelope sample per axis, the one with the highest score.
+Alerts are inserted among the samples of the block at their time. With forward='alerts', a block without alerts
+and markers is only passed on (empty) once per window, so the next listener can still stop the reader.
+"""
+
+from array import array
+
+import numpy as np
+
+from sample_block import SampleBlock, ACC, GAP, ALERT, STRIDE
+
+KIND_SAMPLE = 0
+KIND_RMS = 1
+KIND_PEAK = 2
+KIND_KURTOSIS = 3
+KIND_BAND = 16
+KIND_NAMES = {KIND_SAMPLE: 'sample', KIND_RMS: 'rms', KIND_PEAK: 'peak', KIND_KURTOSIS: 'kurtosis'}
+AXES = ('x', 'y', 'z')
+
+ALERTS_HEADER = "time (ms),kind,axis,band (Hz),value,baseline,score,samples\n"
+
+# Lower bounds of the standard deviations, so a perfectly constant signal doesn't alert on noise
+MIN_STD = 1e-3
+MIN_LOG_STD = 0.05
+
+
+class AnomalyDetector:
+    """
+    Listener stage that flags out-of-envelope samples and windows of the accelerometer
+    """
+
+    def __init__(self, listener, window=256, alpha=0.01, window_alpha=0.05, threshold=6.0, window_threshold=4.0,
+                 bands=16, warmup=20, forward='all', alerts_path=None):
+        """
+
+        :param listener: Next listener (e.g. a writer or FanOut), gets the blocks with the alerts
+        :param window: Number of samples per window for the window features and the spectrum
+        :param alpha: Weight of a new sample in the sample statistics
+        :param window_alpha: Weight of a new window in the feature baselines
+        :param threshold: Standard deviations from the mean beyond which a sample is out of the envelope
+        :param window_threshold: Standard deviations above the baseline beyond which a window feature is anomalous
+        :param bands: Number of frequency bands of the spectrum
+        :param warmup: Number of windows before the first alert (the statistics have to settle)
+        :param forward: 'all' passes all samples on, 'alerts' only the alerts and markers, which reduces what
+        has to be stored or uploaded to the anomalies
+        :param alerts_path: CSV file the alerts are also appended to
+        """
+        if window < 2 * bands + 2:
+            raise ValueError("invalid window [" + str(window) + "] expected at least 2 * bands + 2")
+        if forward not in ('all', 'alerts'):
+            raise ValueError("invalid forward [" + str(forward) + "] expected one of ['all', 'alerts']")
+        self.listener = listener
+        self.window = window
+        self.alpha = alpha
+        self.window_alpha = window_alpha
+        self.threshold = threshold
+        self.window_threshold = window_threshold
+        self.bands = bands
+        self.warmup = warmup
+        self.forward_all = forward == 'all'
+        self.alerts = 0
+
+        # sample statistics: weighted mean and mean of the squares per axis
+        self.samples = 0
+        self.mean = np.zeros(3)
+        self.mean_sq = np.zeros(3)
+        self.__weights = None
+
+        self.__buffer = np.empty((window, 3))
+        self.__times = np.empty(window)
+        self.__filled = 0
+        self.__hann = np.hanning(window)[:, None]
+        # first bin of every band, bin 0 (the mean) is left out
+        self.__band_edges = 1 + (np.arange(bands) * (window // 2) // bands)
+        # feature baselines: weighted mean and mean of the squares of log10(feature), shape (3 + bands, 3)
+        self.windows = 0
+        self.__forwarded_windows = 0
+        self.feature_mean = np.zeros((3 + bands, 3))
+        self.feature_mean_sq = np.zeros((3 + bands, 3))
+
+        self.__alerts = []
+        self.__alerts_file = None
+        if alerts_path is not None:
+            self.__alerts_file = open(alerts_path, 'a')
+            if self.__alerts_file.tell() == 0:
+                self.__alerts_file.write(ALERTS_HEADER)
+
+    def on_sensor_block(self, block):
+        """
+        :returns If the next listener has not been stopped
+        """
+        count = block.count
+        ids = np.frombuffer(block.sensor_ids, dtype=np.uint8)[:count]
+        values = np.frombuffer(block.values, dtype=np.float64)[:count * STRIDE].reshape(-1, STRIDE)
+
+        if (ids == GAP + ACC).any():
+            # the samples before and after a gap don't belong to the same window
+            self.__filled = 0
+        acc = values[ids == ACC]
+        if len(acc):
+            self.__check_samples(acc[:, :3], acc[:, 3])
+            self.__add_to_window(acc)
+
+        if not self.__alerts:
+            if self.forward_all:
+                return self.listener.on_sensor_block(block)
+            markers = ids >= GAP
+            if not markers.any():
+                if self.windows == self.__forwarded_windows:
+                    return True
+                # the listener only tells whether it has been stopped when it gets a block
+                self.__forwarded_windows = self.windows
+            return self.listener.on_sensor_block(_block(ids[markers], values[markers]))
+
+        alerts = np.array(self.__alerts)
+        alerts = alerts[np.argsort(alerts[:, 3], kind='stable')]
+        self.__alerts = []
+        if self.forward_all:
+            kept_ids = ids
+            kept = values
+        else:
+            keep = ids >= GAP
+            kept_ids = ids[keep]
+            kept = values[keep]
+        # after the samples with the same time, so an alert follows the sample or window it is about
+        positions = np.searchsorted(kept[:, 3], alerts[:, 3], side='right')
+        return self.listener.on_sensor_block(_block(np.insert(kept_ids, positions, ALERT),
+                                                    np.insert(kept, positions, alerts, axis=0)))
+
+    def __check_samples(self, x, t):
+        """
+        Flags out-of-envelope samples, then updates the sample statistics
+        """
+        n = len(x)
+        if self.samples == 0:
+            self.mean = x.mean(axis=0)
+            self.mean_sq = (x * x).mean(axis=0)
+        else:
+            if self.windows >= self.warmup:
+                std = np.sqrt(np.maximum(self.mean_sq - self.mean * self.mean, MIN_STD * MIN_STD))
+                scores = np.abs(x - self.mean) / std
+                flagged = scores > self.threshold
+                if flagged.any():
+                    for axis in np.flatnonzero(flagged.any(axis=0)):
+                        i = np.argmax(scores[:, axis])
+                        self.__alert(t[i], KIND_SAMPLE, axis, x[i, axis], self.mean[axis], scores[i, axis],
+                                     samples=int(flagged[:, axis].sum()))
+
+            # exponentially weighted update with all n samples at once
+            weights = self.__weights
+            if weights is None or len(weights) != n:
+                weights = self.__weights = self.alpha * (1 - self.alpha) ** np.arange(n - 1, -1, -1.0)
+            decay = (1 - self.alpha) ** n
+            self.mean = decay * self.mean + weights.dot(x)
+            self.mean_sq = decay * self.mean_sq + weights.dot(x * x)
+        self.samples += n
+
+    def __add_to_window(self, acc):
+        start = 0
+        while start < len(acc):
+            take = min(self.window - self.__filled, len(acc) - start)
+            self.__buffer[self.__filled:self.__filled + take] = acc[start:start + take, :3]
+            self.__times[self.__filled:self.__filled + take] = acc[start:start + take, 3]
+            self.__filled += take
+            start += take
+            if self.__filled == self.window:
+                self.__check_window()
+                self.__filled = 0
+
+    def __check_window(self):
+        """
+        Computes the features of a full window, compares them with the baselines and updates the baselines
+        """
+        vibration = self.__buffer - self.__buffer.mean(axis=0)
+        power = vibration * vibration
+        rms = np.sqrt(power.mean(axis=0))
+        peak = np.abs(vibration).max(axis=0)
+        kurtosis = (power * power).mean(axis=0) / np.maximum(rms ** 4, 1e-30)
+        spectrum = np.abs(np.fft.rfft(vibration * self.__hann, axis=0)) ** 2
+        band_power = np.add.reduceat(spectrum[1:self.window // 2 + 1], self.__band_edges - 1, axis=0)
+        features = np.log10(np.maximum(np.vstack((rms, peak, kurtosis, band_power)), 1e-30))
+
+        if self.windows == 0:
+            self.feature_mean = features
+            self.feature_mean_sq = features * features
+        else:
+            if self.windows >= self.warmup:
+                std = np.sqrt(np.maximum(self.feature_mean_sq - self.feature_mean ** 2, MIN_LOG_STD ** 2))
+                scores = (features - self.feature_mean) / std
+                if (scores > self.window_threshold).any():
+                    self.__window_alerts(features, scores)
+            a = self.window_alpha
+            self.feature_mean = (1 - a) * self.feature_mean + a * features
+            self.feature_mean_sq = (1 - a) * self.feature_mean_sq + a * features * features
+        self.windows += 1
+
+    def __window_alerts(self, features, scores):
+        t = self.__times[-1]
+        duration_s = (t - self.__times[0]) / 1000.0
+        # bin width of the spectrum, from the sample times as the rate may differ from the configured one
+        bin_hz = (self.window - 1) / duration_s / self.window if duration_s > 0 else 0.0
+        for feature, axis in zip(*np.nonzero(scores > self.window_threshold)):
+            if feature < 3:
+                kind = KIND_RMS + feature
+                band = None
+            else:
+                kind = KIND_BAND + feature - 3
+                first = self.__band_edges[feature - 3]
+                last = self.__band_edges[feature - 2] if feature - 2 < self.bands else self.window // 2 + 1
+                band = (first * bin_hz, last * bin_hz)
+            self.__alert(t, kind, axis, 10 ** features[feature, axis], 10 ** self.feature_mean[feature, axis],
+                         scores[feature, axis], band=band)
+
+    def __alert(self, t, kind, axis, value, baseline, score, band=None, samples=1):
+        self.alerts += 1
+        self.__alerts.append((kind, axis, score, t))
+        if self.__alerts_file is not None:
+            name = KIND_NAMES.get(kind, 'band')
+            band_str = '' if band is None else ('%.1f-%.1f' % band)
+            self.__alerts_file.write('%.1f,%s,%s,%s,%.6g,%.6g,%.2f,%d\n' % (t, name, AXES[axis], band_str, value,
+                                                                             baseline, score, samples))
+            self.__alerts_file.flush()
+
+    def close(self):
+        if self.__alerts_file is not None:
+            self.__alerts_file.close()
+
+
+def _block(ids, values):
+    """
+    :return: SampleBlock with the given sensor ids and rows of values
+    """
+    return SampleBlock.from_arrays(array('B', ids.astype(np.uint8).tobytes()),
+                                   array('d', np.ascontiguousarray(values, dtype=np.float64).tobytes()))
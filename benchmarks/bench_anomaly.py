@@ -0,0 +1,102 @@
+"""
+Anomaly detector benchmark: feeds a synthetic accelerometer stream of a running machine (gravity, a 50 Hz
+vibration and noise) through AnomalyDetector in blocks, injects faults, and reports
+- the time per block and the resulting CPU share at the given sample rate
+- the alerts before the first fault (false alerts) and the first alert after every fault
+
+Faults: a new 180 Hz component (e.g. a bearing) from 60 s on, a single 1 g shock at 90 s.
+
+Usage: python benchmarks/bench_anomaly.py [--rate 800] [--block-size 64] [--seconds 120]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anomaly_detector import AnomalyDetector, KIND_NAMES, KIND_BAND, AXES
+from sample_block import SampleBlock, ACC, ALERT, STRIDE
+
+FAULTS = ((60.0, '180 Hz component'), (90.0, '1 g shock'))
+
+
+class AlertCollector:
+    def __init__(self):
+        self.alerts = []
+
+    def on_sensor_block(self, block):
+        for i in range(block.count):
+            if block.sensor_ids[i] == ALERT:
+                kind, axis, score, t = block.values[i * STRIDE:(i + 1) * STRIDE]
+                self.alerts.append((t / 1000.0, int(kind), int(axis), score))
+        return True
+
+
+def signal(rate, seconds, seed=1):
+    random = np.random.RandomState(seed)
+    t = np.arange(int(rate * seconds)) / float(rate)
+    acc = np.empty((len(t), 3))
+    acc[:, 0] = 0.05 * np.sin(2 * np.pi * 50 * t) + 0.01 * random.randn(len(t))
+    acc[:, 1] = 0.03 * np.sin(2 * np.pi * 50 * t + 1) + 0.01 * random.randn(len(t))
+    acc[:, 2] = 1.0 + 0.01 * random.randn(len(t))
+    bearing = t >= FAULTS[0][0]
+    acc[bearing, 0] += 0.02 * np.sin(2 * np.pi * 180 * t[bearing])
+    acc[int(FAULTS[1][0] * rate), 1] += 1.0
+    return t * 1000.0, acc
+
+
+def describe(alert):
+    t, kind, axis, score = alert
+    name = KIND_NAMES.get(kind, 'band ' + str(kind - KIND_BAND))
+    return '%8.3f s  %-10s %s  score %.1f' % (t, name, AXES[axis], score)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=int, default=800, help="sample rate (Hz)")
+    parser.add_argument("--block-size", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=120)
+    args = parser.parse_args()
+
+    times, acc = signal(args.rate, args.seconds)
+    blocks = []
+    for start in range(0, len(times), args.block_size):
+        n = min(args.block_size, len(times) - start)
+        block = SampleBlock(n)
+        values = np.frombuffer(block.values, dtype=np.float64).reshape(-1, STRIDE)
+        values[:, :3] = acc[start:start + n]
+        values[:, 3] = times[start:start + n]
+        for i in range(n):
+            block.sensor_ids[i] = ACC
+        block.count = n
+        blocks.append(block)
+
+    collector = AlertCollector()
+    detector = AnomalyDetector(collector)
+    started = time.perf_counter()
+    for block in blocks:
+        detector.on_sensor_block(block)
+    elapsed = time.perf_counter() - started
+
+    per_block = elapsed / len(blocks)
+    print('%d blocks of %d samples: %.1f us per block, %.3f %% of a core at %d Hz' % (
+        len(blocks), args.block_size, per_block * 1e6, per_block * args.rate / args.block_size * 100, args.rate))
+
+    false_alerts = [alert for alert in collector.alerts if alert[0] < FAULTS[0][0]]
+    print('alerts before the first fault: ' + str(len(false_alerts)))
+    for alert in false_alerts[:5]:
+        print('  ' + describe(alert))
+    for i, (fault_s, name) in enumerate(FAULTS):
+        end_s = FAULTS[i + 1][0] if i + 1 < len(FAULTS) else args.seconds
+        alerts = [alert for alert in collector.alerts if fault_s <= alert[0] < end_s]
+        print(name + ' at ' + str(fault_s) + ' s: ' + str(len(alerts)) + ' alerts')
+        for alert in alerts[:4]:
+            print('  ' + describe(alert))
+
+
+if __name__ == '__main__':
+    main()
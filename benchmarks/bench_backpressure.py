@@ -0,0 +1,106 @@
+"""
+Backpressure benchmark: runs SensorReader on a SimulatedBus (which is much faster than the real sensors)
+into a StdoutWriter whose consumer is throttled to a fixed number of samples per second, and reports for
+every flow control policy how far the backlog grew, the memory of the producer and what was degraded.
+
+With the policy 'none' the queue grows without bound, the others keep it below max_queued blocks.
+
+Usage: python benchmarks/bench_backpressure.py [--seconds 5] [--consumer-rate 20000] [--max-queued 64]
+                                               [--policy decimate]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stdout_writer
+from acquisition_profile import AcquisitionProfile
+from flow_control import FlowControl, POLICIES
+from sample_block import SENSOR_NAMES
+from sensor_reader import SensorReader
+from stdout_writer import StdoutWriter
+
+
+class SlowWriter(StdoutWriter):
+    """
+    Counts the samples per sensor type instead of printing them, at most rate samples per second
+    """
+
+    def __init__(self, rate, queue_size=0):
+        StdoutWriter.__init__(self, queue_size=queue_size)
+        self.delay = 1.0 / rate
+        self.counts = multiprocessing.Array('q', len(SENSOR_NAMES))
+        self.types = dict((name, i) for i, name in enumerate(SENSOR_NAMES))
+
+    def _write_sample(self, sample):
+        self.counts[self.types[sample.sensor_type]] += 1
+        time.sleep(self.delay)
+
+
+class Monitor:
+    """
+    Stops after a fixed duration and records the peak backlog of the writer
+    """
+
+    def __init__(self, listener, writer, seconds):
+        self.listener = listener
+        self.writer = writer
+        self.stop_at = time.time() + seconds
+        self.peak_backlog = 0
+
+    def on_sensor_block(self, block):
+        self.peak_backlog = max(self.peak_backlog, self.writer.backlog())
+        return self.listener.on_sensor_block(block) and time.time() < self.stop_at
+
+
+def run(policy, seconds, consumer_rate, max_queued):
+    profile = AcquisitionProfile({'transport': {'type': 'simulated'}, 'schedule': 'full',
+                                  'flow_control': {'policy': policy,
+                                                   'max_queued': max_queued, 'recover_after': 2}})
+    reader = SensorReader(profile=profile, paced=False)
+    writer = SlowWriter(consumer_rate)
+    stdout_writer.stop.value = 0
+    flow_control = FlowControl(writer, policy, max_queued, profile.recover_after, reader=reader)
+    monitor = Monitor(flow_control, writer, seconds)
+    reader.set_sensor_listener(monitor)
+
+    consumer = multiprocessing.Process(target=writer.start_write_loop)
+    consumer.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        reader.start_reading()
+    finally:
+        sys.stdout = sys.__stdout__
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    consumer.terminate()
+    consumer.join()
+    # the blocks still queued would otherwise keep the benchmark from exiting
+    writer.close()
+
+    markers = ', '.join(name + ': ' + str(writer.counts[i]) for i, name in enumerate(SENSOR_NAMES)
+                        if name in ('dropped', 'decimated', 'rate') and writer.counts[i])
+    print('%-12s read %9d  peak backlog %6d blocks  rss +%7d kB  dropped %9d  factor %2d  acc rate %6s  %s' % (
+        policy, reader.read_samples, monitor.peak_backlog, rss_growth, flow_control.dropped_samples,
+        flow_control.factor, reader.acc_rate, markers or 'no markers written'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5, help="duration per policy")
+    parser.add_argument("--consumer-rate", type=int, default=20000, help="samples per second the consumer writes")
+    parser.add_argument("--max-queued", type=int, default=64, help="maximum number of queued blocks")
+    parser.add_argument("--policy", help="only run this policy", choices=POLICIES)
+    args = parser.parse_args()
+
+    for policy in [args.policy] if args.policy else POLICIES:
+        run(policy, args.seconds, args.consumer_rate, args.max_queued)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Fault recovery benchmark: reads the accelerometer from a SimulatedBus, then makes the device fail for a while
+and lose its configuration (a brownout), and checks that the reader recovers:
+- the errors and re-initialisations are counted in bus_stats()
+- the configuration registers are written again
+- a gap_acc marker with the length of the outage (x) and the number of errors (y) is in the stream
+- the reader sleeps while the device backs off instead of spinning (few skipped iterations, little CPU)
+
+Exits with an AssertionError if one of the checks fails.
+
+Usage: python benchmarks/bench_fault_recovery.py [--faults 10]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acquisition_profile import AcquisitionProfile
+from adxl345.base import ADXL345_Base
+from sample_block import ACC, GAP, STRIDE
+from sensor_reader import SensorReader
+from sim_bus import SimulatedBus
+
+# blocks read before the fault and after the recovery
+BLOCKS_BEFORE = 50
+BLOCKS_AFTER = 50
+
+
+class FaultInjector:
+    """
+    Injects the fault after BLOCKS_BEFORE blocks and stops BLOCKS_AFTER blocks after the gap marker
+    """
+
+    def __init__(self, bus, address, faults):
+        self.bus = bus
+        self.address = address
+        self.faults = faults
+        self.blocks = 0
+        self.gaps = []
+        self.fault_cpu = None
+        self.fault_time = None
+        self.recovery_cpu = None
+        self.recovery_time = None
+        self.blocks_after_gap = None
+
+    def on_sensor_block(self, block):
+        self.blocks += 1
+        for i in range(block.count):
+            if block.sensor_ids[i] == GAP + ACC:
+                self.gaps.append(tuple(block.values[i * STRIDE:(i + 1) * STRIDE]))
+                self.recovery_cpu = time.process_time()
+                self.recovery_time = time.time()
+                self.blocks_after_gap = 0
+        if self.blocks == BLOCKS_BEFORE:
+            self.fault_cpu = time.process_time()
+            self.fault_time = time.time()
+            self.bus.inject_faults(self.faults, self.address)
+            self.bus.brownout(self.address)
+        if self.blocks_after_gap is not None:
+            self.blocks_after_gap += 1
+            return self.blocks_after_gap < BLOCKS_AFTER
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faults", type=int, default=10, help="number of failing bus operations")
+    args = parser.parse_args()
+
+    bus = SimulatedBus()
+    profile = AcquisitionProfile({'schedule': ['acc'], 'block_size': 16})
+    reader = SensorReader(bus=bus, profile=profile)
+    address = reader.accelerometer.i2caddress
+    injector = FaultInjector(bus, address, args.faults)
+    reader.set_sensor_listener(injector)
+    reader.start_reading()
+
+    stats = reader.bus_stats()['acc']
+    outage_s = injector.recovery_time - injector.fault_time
+    cpu_s = injector.recovery_cpu - injector.fault_cpu
+    print('outage: %.3f s, CPU during the outage: %.3f s' % (outage_s, cpu_s))
+    print('acc: ' + ', '.join(key + ' ' + str(stats[key]) for key in sorted(stats)))
+    print('gap markers: ' + str(injector.gaps))
+
+    assert stats['errors'] == args.faults, stats
+    assert stats['failures'] >= 1 and stats['reinits'] >= 1, stats
+    # every backoff is slept through instead of checking the clock in a loop
+    assert stats['skipped'] <= stats['failures'], stats
+    assert cpu_s < 0.5 * outage_s, (cpu_s, outage_s)
+
+    registers = bus.registers[address]
+    rate = profile.acc['rate']
+    assert registers[ADXL345_Base.REG_BW_RATE] == ADXL345_Base.data_rate_code(rate)[1], 'BW_RATE not restored'
+    assert registers[ADXL345_Base.REG_DATA_FORMAT] & 0x08, 'full resolution not restored'
+    assert registers[ADXL345_Base.REG_POWER_CTL] & 0x08, 'measurement mode not restored'
+
+    assert len(injector.gaps) == 1, injector.gaps
+    gap_ms, gap_errors, zero, t = injector.gaps[0]
+    assert gap_errors == args.faults, injector.gaps
+    assert 0 < gap_ms <= outage_s * 1000.0 + 1.0, (gap_ms, outage_s)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Microbenchmark of the acquisition hot loop in SensorReader.start_reading.
+
+The sensors are on a bus that returns a constant register buffer, so the measured time per iteration
+is the Python overhead of the loop (dispatch, conversion, timestamping, passing samples on) and not I/O.
+The cost of the bus calls alone is measured separately and subtracted. Every configuration is run
+several times and the fastest run is reported, which filters out scheduling noise.
+
+Usage: python benchmarks/bench_hot_loop.py [iterations] [repeats]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sensor_reader import SensorReader, ACC_SCHEDULE, FULL_SCHEDULE
+from sim_bus import SimulatedBus
+
+
+class NullBus(SimulatedBus):
+    """
+    Bus without any cost beyond the method call
+    """
+
+    def __init__(self):
+        SimulatedBus.__init__(self)
+        self.data = [0x12, 0x01, 0x34, 0xFE, 0x00, 0x01] + [0] * 26
+
+    def read_i2c_block_data(self, address, register, length=32):
+        return self.data
+
+    def read_word_data(self, address, register):
+        return 0x3412
+
+
+class BlockCounter:
+    def __init__(self, n):
+        self.n = n
+        self.count = 0
+
+    def on_sensor_block(self, block):
+        self.count += block.count
+        return self.count < self.n
+
+
+class DataPointCounter:
+    def __init__(self, n):
+        self.n = n
+        self.count = 0
+
+    def on_sensor_data_changed(self, data_point):
+        self.count += 1
+        return self.count < self.n
+
+
+def bus_cost(bus, n):
+    read_i2c_block_data = bus.read_i2c_block_data
+    start = time.perf_counter()
+    for i in range(n):
+        read_i2c_block_data(0x53, 0x32, 6)
+    return (time.perf_counter() - start) / n
+
+
+def run(listener_class, schedule, n):
+    reader = SensorReader(bus=NullBus(), schedule=schedule, paced=False)
+    reader.set_sensor_listener(listener_class(n))
+    start = time.perf_counter()
+    reader.start_reading()
+    return (time.perf_counter() - start) / reader.read_samples
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    io = min(bus_cost(NullBus(), n) for i in range(repeats))
+    print('bus call: %.0f ns' % (io * 1e9))
+    results = []
+    for name, schedule in (('acc only', ACC_SCHEDULE), ('acc+gyr+comp', FULL_SCHEDULE)):
+        for listener_class in (BlockCounter, DataPointCounter):
+            per_iteration = min(run(listener_class, schedule, n) for i in range(repeats))
+            results.append((name, listener_class.__name__, per_iteration))
+    print('')
+    print('%-14s %-18s %12s %14s' % ('schedule', 'listener', 'ns/iter', 'ns/iter - bus'))
+    for name, listener, per_iteration in results:
+        print('%-14s %-18s %12.0f %14.0f' % (name, listener, per_iteration * 1e9, (per_iteration - io) * 1e9))
+
+
+if __name__ == '__main__':
+    main()
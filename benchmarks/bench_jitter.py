@@ -0,0 +1,76 @@
+"""
+Jitter benchmark: runs SensorReader for a while and reports percentiles of the intervals between
+consecutive sample timestamps. Compare runs with and without the real-time options of main.py.
+
+By default the sensors are on a SimulatedBus, so the intervals show the jitter of the Python loop
+itself (GC pauses, preemption). Use --hardware on the Pi to read from the I2C bus.
+
+Usage: python benchmarks/bench_jitter.py [--profile profiles/high_throughput.json] [--seconds 10] [--cpu 3]
+                                        [--rt-priority 50] [--mlock] [--manual-gc]
+"""
+
+import argparse
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import realtime
+from acquisition_profile import load_profile
+from sample_block import STRIDE
+from sensor_reader import SensorReader
+from sim_bus import SimulatedBus
+
+PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+
+class TimestampRecorder:
+    """
+    Stores the sample timestamps of a fixed duration
+    """
+
+    def __init__(self, seconds):
+        self.duration_ms = seconds * 1000.0
+        self.times = array('d')
+
+    def on_sensor_block(self, block):
+        self.times.extend(block.values[STRIDE - 1:block.count * STRIDE:STRIDE])
+        return self.times[-1] < self.duration_ms
+
+
+def percentile(sorted_values, p):
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", help="acquisition profile to benchmark (sensor settings and schedule)")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of the measurement")
+    parser.add_argument("--hardware", help="read from the I2C bus instead of a simulated bus", action="store_true")
+    parser.add_argument("--cpu", type=int, help="pin the reader to this core")
+    parser.add_argument("--rt-priority", type=int, help="SCHED_FIFO priority (1-99)")
+    parser.add_argument("--mlock", help="lock memory into RAM", action="store_true")
+    parser.add_argument("--manual-gc", help="disable the garbage collector in the loop", action="store_true")
+    args = parser.parse_args()
+
+    realtime.apply(cpus=None if args.cpu is None else [args.cpu], priority=args.rt_priority, lock=args.mlock)
+
+    bus = None if args.hardware else SimulatedBus()
+    reader = SensorReader(bus=bus, manual_gc=args.manual_gc, profile=load_profile(args.profile))
+    recorder = TimestampRecorder(args.seconds)
+    reader.set_sensor_listener(recorder)
+    reader.start_reading()
+
+    times = recorder.times
+    intervals = sorted(times[i] - times[i - 1] for i in range(1, len(times)))
+    print('')
+    print('samples: ' + str(len(times)) + ', mean interval: %.4f ms' % ((times[-1] - times[0]) / len(intervals)))
+    for p in PERCENTILES:
+        print('p%-6s %10.4f ms' % (p, percentile(intervals, p)))
+    print('max     %10.4f ms' % intervals[-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Throughput of ReplaySource: replays a synthetic recording as fast as possible to a listener that
+only counts samples, once parsing the file in chunks and once from memory (preload).
+
+Usage: python benchmarks/bench_replay.py [samples]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_point import DataPoint
+from replay_source import ReplaySource
+
+
+class BlockCounter:
+    def __init__(self):
+        self.count = 0
+
+    def on_sensor_block(self, block):
+        self.count += block.count
+        return True
+
+
+def write_recording(path, n):
+    with open(path, 'w') as f:
+        f.write("Sensor type,x,y,z,time (ms)\n")
+        for i in range(n):
+            f.write(str(DataPoint(0.01 * (i % 100), -0.5, 1.0, i * 1.25, 'acc')) + '\n')
+
+
+def run(source):
+    listener = BlockCounter()
+    source.set_sensor_listener(listener)
+    start = time.perf_counter()
+    source.start_reading()
+    return listener.count / (time.perf_counter() - start)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    fd, path = tempfile.mkstemp(prefix='recording_')
+    os.close(fd)
+    try:
+        write_recording(path, n)
+        streamed = run(ReplaySource(path, speed=None, block_size=1024))
+        preloaded = ReplaySource(path, speed=None, block_size=1024, preload=True)
+        preloaded._load()
+        from_memory = run(preloaded)
+    finally:
+        os.remove(path)
+    print('')
+    print('chunked parsing: %12.0f samples/sec' % streamed)
+    print('preloaded:       %12.0f samples/sec' % from_memory)
+
+
+if __name__ == '__main__':
+    main()
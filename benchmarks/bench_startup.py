@@ -0,0 +1,91 @@
+"""
+Startup benchmark: how long it takes from launching the interpreter to the first sample.
+
+Every run is a fresh process which reports
+- interpreter: from launching the process until the first statement of the child runs
+- import: importing the modules the entry point needs (acquisition_profile, sensor_reader)
+- init: loading the profile and opening and configuring the devices (SensorReader())
+- first sample: from the end of init until the first sample has been read
+
+By default the sensors are on a SimulatedBus. Use --hardware on the Pi to measure the real device init.
+
+Usage: python benchmarks/bench_startup.py [--profile profiles/default.json] [--runs 5] [--hardware]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(profile_path, hardware):
+    started = time.time()
+    sys.path.insert(0, ROOT)
+    bus = None
+    if not hardware:
+        # not part of the measured startup
+        from sim_bus import SimulatedBus
+        bus = SimulatedBus()
+        started = time.time()
+
+    from acquisition_profile import load_profile
+    from sensor_reader import SensorReader
+    imported = time.time()
+
+    # the first sample is passed on right away instead of with a full block
+    reader = SensorReader(bus=bus, block_size=1, profile=load_profile(profile_path))
+    initialized = time.time()
+
+    class FirstSample:
+        time = None
+
+        def on_sensor_data_changed(self, data_point):
+            self.time = time.time()
+            return False
+
+    listener = FirstSample()
+    reader.set_sensor_listener(listener)
+    reader.start_reading()
+
+    print(json.dumps({'started': started, 'import': imported - started, 'init': initialized - imported,
+                      'first_sample': listener.time - initialized}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", help="acquisition profile to start")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh processes, the median is reported")
+    parser.add_argument("--hardware", help="open the I2C bus instead of a simulated bus", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS, action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.profile, args.hardware)
+        return
+
+    command = [sys.executable, os.path.abspath(__file__), '--child']
+    if args.profile:
+        command += ['--profile', args.profile]
+    if args.hardware:
+        command.append('--hardware')
+
+    results = []
+    for i in range(args.runs):
+        launched = time.time()
+        output = subprocess.check_output(command, cwd=ROOT).decode()
+        result = json.loads(output.strip().splitlines()[-1])
+        result['interpreter'] = result.pop('started') - launched
+        results.append(result)
+
+    print('median of ' + str(args.runs) + ' runs:')
+    for key in ('interpreter', 'import', 'init', 'first_sample'):
+        values = sorted(result[key] for result in results)
+        print('  %-12s %8.2f ms' % (key, values[len(values) // 2] * 1000))
+
+
+if __name__ == '__main__':
+    main()
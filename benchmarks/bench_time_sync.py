@@ -0,0 +1,139 @@
+"""
+Time synchronization benchmark: a Coordinator and several node processes on loopback, every node with an
+artificially skewed clock (offset of seconds and a drift far larger than that of a real crystal). Each
+node syncs, starts a SensorReader on the shared epoch, records from a SimulatedBus and keeps syncing in
+its own process, like main.py --coordinator does. The recordings are then merged with time_sync.merge.
+
+For every sample the true time (time.time() when it was delivered) is stored as well, and the aligned
+times of the merged recordings are compared with it.
+
+Usage: python benchmarks/bench_time_sync.py [--nodes 3] [--seconds 10] [--sync-interval 1]
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acquisition_profile import AcquisitionProfile
+from sensor_reader import SensorReader
+from time_sync import Coordinator, SyncClient, SyncMetadata, merge
+
+# offset (s) and drift (ppm) of the node clocks
+SKEWS = ((1.5, 300.0), (-0.8, -450.0), (0.25, 120.0), (-3.0, 0.0), (0.0, -200.0))
+SAMPLE_RATE = 200
+
+
+class SkewedClock:
+    def __init__(self, offset, drift_ppm):
+        self.base = time.time()
+        self.offset = offset
+        self.drift = drift_ppm * 1e-6
+
+    def __call__(self):
+        t = time.time()
+        return t + self.offset + (t - self.base) * self.drift
+
+
+class Recorder:
+    """
+    Writes the samples like FileWriter does and keeps the true time at which each one arrived
+    """
+
+    def __init__(self, path, seconds):
+        self.f = open(path, 'w')
+        self.f.write("Sensor type,x,y,z,time (ms)\n")
+        self.true_ms = array('d')
+        self.stop_at = None
+        self.seconds = seconds
+
+    def on_sensor_data_changed(self, data_point):
+        now = time.time()
+        self.true_ms.append(now * 1000.0)
+        self.f.write(str(data_point) + '\n')
+        if self.stop_at is None:
+            self.stop_at = now + self.seconds
+        return now < self.stop_at
+
+
+def node(name, port, skew, directory, seconds, sync_interval):
+    clock = SkewedClock(*skew)
+    client = SyncClient(('127.0.0.1', port), name, clock=clock)
+    epoch_ms = client.wait_for_epoch()
+    start_ms = client.local_time(epoch_ms)
+
+    sync_path = os.path.join(directory, 'sync_' + name + '.json')
+    sync = multiprocessing.Process(target=client.run, args=(sync_path, epoch_ms, start_ms, sync_interval))
+    sync.start()
+
+    profile = AcquisitionProfile({'transport': {'type': 'simulated'}, 'block_size': 1})
+    reader = SensorReader(profile=profile, clock=clock)
+    reader.set_accelerometer_rate(SAMPLE_RATE)
+    recorder = Recorder(os.path.join(directory, 'recording_' + name), seconds)
+    reader.set_sensor_listener(recorder)
+    sys.stdout = open(os.devnull, 'w')
+    reader.start_reading(start_ms)
+    recorder.f.close()
+    sync.terminate()
+    with open(os.path.join(directory, 'truth_' + name), 'wb') as f:
+        recorder.true_ms.tofile(f)
+
+
+def percentile(sorted_values, p):
+    return sorted_values[int(round(p / 100.0 * (len(sorted_values) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=3, choices=range(1, len(SKEWS) + 1))
+    parser.add_argument("--seconds", type=float, default=10, help="duration of the recordings")
+    parser.add_argument("--sync-interval", type=float, default=1.0, help="seconds between sync rounds")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    coordinator = Coordinator(0, args.nodes, lead=1.0, host='127.0.0.1')
+    server = multiprocessing.Process(target=coordinator.serve)
+    server.start()
+    names = ['node' + str(i + 1) for i in range(args.nodes)]
+    nodes = [multiprocessing.Process(target=node, args=(name, coordinator.port, SKEWS[i], directory, args.seconds,
+                                                        args.sync_interval))
+             for i, name in enumerate(names)]
+    for process in nodes:
+        process.start()
+    for process in nodes:
+        process.join()
+    server.terminate()
+
+    recordings = [(os.path.join(directory, 'recording_' + name), os.path.join(directory, 'sync_' + name + '.json'))
+                  for name in names]
+    merged = os.path.join(directory, 'merged.csv')
+    print('merged ' + str(merge(merged, recordings)) + ' samples')
+
+    print('%-6s %9s %10s %12s %10s %9s %9s %9s' % ('node', 'offset s', 'drift ppm', 'est. ppm', 'start ms',
+                                                    'p50 ms', 'p99 ms', 'max ms'))
+    for i, name in enumerate(names):
+        metadata = SyncMetadata(recordings[i][1])
+        true_ms = array('d')
+        with open(os.path.join(directory, 'truth_' + name), 'rb') as f:
+            true_ms.frombytes(f.read())
+        with open(recordings[i][0]) as f:
+            f.readline()
+            times = [float(line.rsplit(',', 1)[1]) for line in f]
+        errors = sorted(abs(metadata.aligned_time(t) + metadata.epoch_ms - true)
+                        for t, true in zip(times, true_ms))
+        # when the first sample was taken, relative to the epoch
+        first = metadata.aligned_time(times[0])
+        print('%-6s %9.2f %10.1f %12.1f %10.3f %9.4f %9.4f %9.4f' % (
+            name, SKEWS[i][0], SKEWS[i][1], -metadata.model.drift * 1e6, first, percentile(errors, 50),
+            percentile(errors, 99), errors[-1]))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
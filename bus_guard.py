@@ -0,0 +1,153 @@
+import time
+
+
+class DeviceGuard:
+    """
+    Wraps bus access to a single device so that I/O errors don't kill the acquisition loop.
+
+    A failing read is retried a bounded number of times. If all attempts fail, the device is put into
+    exponential backoff: calls return None immediately (without touching the bus) until the backoff expires,
+    so the other sensors keep being sampled. Because a device that stops answering has often lost power,
+    its configuration is written again before the next attempt. The time and number of errors of an outage
+    are kept until the device answers again, so the reader can put a gap marker into the stream.
+    """
+
+    def __init__(self, name, init=None, retries=2, backoff_initial=0.01, backoff_max=1.0, clock=time.time):
+        """
+
+        :param name: Sensor name used in gap markers and metrics
+        :param init: Function that (re-)writes the device configuration. Called after an outage.
+        :param retries: Number of immediate retries after a failed read
+        :param backoff_initial: Seconds to skip the device after the first exhausted read
+        :param backoff_max: Upper bound for the backoff, which doubles with every failed attempt
+        :param clock: Returns the current time in seconds
+        """
+        self.name = name
+        self.init = init
+        self.retries = retries
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.clock = clock
+
+        self.reads = 0
+        self.errors = 0
+        self.failures = 0
+        self.skipped = 0
+        self.reinits = 0
+
+        self.gap_pending = False
+        self.gap_started = None
+        self.gap_errors = 0
+
+        # True while the device answers, i.e. there is no backoff or re-initialisation pending
+        self.ready = True
+        # clock time before which the device is skipped, None if it isn't backing off
+        self.retry_at = None
+        self.__consecutive_failures = 0
+        self.__needs_init = False
+
+    def call(self, fn, *args):
+        """
+        Calls fn (a bus operation of this device) with retries.
+        :return: The result of fn, or None if the device is currently unavailable
+        """
+        if self.ready:
+            # fast path for a healthy device, this is called for every sample
+            try:
+                result = fn(*args)
+            except IOError:
+                return self.retry(fn, *args)
+            self.reads += 1
+            return result
+        return self._recover(fn, args, self.retries + 1)
+
+    def retry(self, fn, *args):
+        """
+        Like call, for when the first attempt has already failed with an IOError. Hot loops can call
+        the bus directly while the device is ready (counting reads themselves) and only use this on errors.
+        """
+        self.errors += 1
+        self.gap_errors += 1
+        return self._recover(fn, args, self.retries)
+
+    def _recover(self, fn, args, attempts):
+        if self.retry_at is not None:
+            if self.clock() < self.retry_at:
+                self.skipped += 1
+                return None
+            self.retry_at = None
+
+        if self.__needs_init and self.init is not None:
+            try:
+                self.init()
+            except IOError:
+                self.errors += 1
+                self.gap_errors += 1
+                self._fail()
+                return None
+            self.reinits += 1
+        self.__needs_init = False
+
+        for attempt in range(attempts):
+            try:
+                result = fn(*args)
+            except IOError:
+                self.errors += 1
+                self.gap_errors += 1
+                continue
+
+            self.reads += 1
+            if self.__consecutive_failures:
+                self.__consecutive_failures = 0
+                self.gap_pending = True
+            elif not self.gap_pending:
+                # errors that were recovered by a retry don't make a gap
+                self.gap_errors = 0
+            self.ready = True
+            return result
+
+        self._fail()
+        return None
+
+    def _fail(self):
+        self.ready = False
+        self.failures += 1
+        self.__consecutive_failures += 1
+        self.__needs_init = True
+        now = self.clock()
+        if self.gap_started is None:
+            self.gap_started = now
+        backoff = min(self.backoff_max, self.backoff_initial * 2 ** (self.__consecutive_failures - 1))
+        self.retry_at = now + backoff
+
+    def take_gap(self):
+        """
+        Returns and clears the outage that ended with the last successful read
+        :return: Tuple (time in seconds at which the outage started, number of I/O errors during the outage)
+        """
+        gap = (self.gap_started, self.gap_errors)
+        self.gap_pending = False
+        self.gap_started = None
+        self.gap_errors = 0
+        return gap
+
+    def is_available(self):
+        return self.__consecutive_failures == 0
+
+    def error_rate(self):
+        """
+
+        :return: Fraction of bus operations that raised an I/O error
+        """
+        attempts = self.reads + self.errors
+        if attempts == 0:
+            return 0.0
+        return self.errors / float(attempts)
+
+    def stats(self):
+        return {'reads': self.reads,
+                'errors': self.errors,
+                'failures': self.failures,
+                'skipped': self.skipped,
+                'reinits': self.reinits,
+                'error_rate': self.error_rate()}
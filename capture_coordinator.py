@@ -0,0 +1,22 @@
+import argparse
+
+from time_sync import Coordinator, DEFAULT_PORT
+
+# Reference clock and start signal for a capture with several nodes. Start this first, then main.py with
+# --coordinator on every node. Stop it with Ctrl+C once the recordings are done.
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--nodes", type=int, default=1, help="number of nodes that record")
+parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="UDP port")
+parser.add_argument("--lead", type=float, default=2.0,
+                    help="seconds between the last node registering and the start of the recording")
+args = parser.parse_args()
+
+coordinator = Coordinator(args.port, args.nodes, args.lead)
+print('Waiting for ' + str(args.nodes) + ' node(s) on UDP port ' + str(coordinator.port))
+try:
+    coordinator.serve()
+except KeyboardInterrupt:
+    pass
+finally:
+    coordinator.close()
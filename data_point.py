@@ -24,8 +24,11 @@ class DataPoint:
     def __str__(self):
         decimals = int(((self.time - int(self.time)) * 10000)) / 10000.0
         time_str = str(int(self.time) + decimals)
+        # Keep all integer digits of the time (and one decimal), it is only truncated to 6 characters
+        # while that doesn't change its magnitude
+        time_str = time_str[:max(6, time_str.find('.') + 2)]
         return self.sensor_type + ',' + format(self.x) + ',' + format(self.y) + ',' + format(
-            self.z) + ',' + trunc(time_str)
+            self.z) + ',' + time_str
 
     @staticmethod
     def from_str(serialized):
@@ -0,0 +1,28 @@
+class FanOut:
+    """
+    Passes the samples of one producer to several listeners (e.g. a FileWriter and a StdoutWriter)
+    """
+
+    def __init__(self, listeners):
+        self.listeners = list(listeners)
+
+    def on_sensor_block(self, block):
+        """
+        :returns False as soon as one of the listeners has been stopped
+        """
+        accepted = True
+        for listener in self.listeners:
+            if hasattr(listener, 'on_sensor_block'):
+                accepted = listener.on_sensor_block(block) and accepted
+            else:
+                for data_point in block.data_points():
+                    if not listener.on_sensor_data_changed(data_point):
+                        accepted = False
+                        break
+        return accepted
+
+    def on_sensor_data_changed(self, data_point):
+        accepted = True
+        for listener in self.listeners:
+            accepted = listener.on_sensor_data_changed(data_point) and accepted
+        return accepted
@@ -2,39 +2,31 @@ import os
 from os import listdir
 from os.path import isfile, join
 import multiprocessing
-from multiprocessing import Queue
+
+from recording_index import IndexWriter
+from writer_base import WriterBase
 
 stop = multiprocessing.Value("i", 0)
 
 
-class FileWriter:
-    def __init__(self, path='/home/pi/sensor_recordings/'):
+class FileWriter(WriterBase):
+    def __init__(self, path='/home/pi/sensor_recordings/', index_interval=1024, queue_size=0):
         """
 
         :param path: Directory in which files will be written
+        :param index_interval: Number of samples per entry of the time index (see recording_index)
+        :param queue_size: Maximum number of queued items (samples or blocks), 0 is unbounded
         """
 
-        # for multiprocessing
-        self.__buffer = Queue()
+        WriterBase.__init__(self, stop, queue_size)
         self.path = path
         self.fname = None
+        self.index_interval = index_interval
 
     def _write_header(self):
-        self.__f.write("Sensor type,x,y,z,time (ms)\n")
-
-    def on_sensor_data_changed(self, data_point):
-        """
-        Passes data to the consumer (consumer/producer architecture). Runs on producer process.
-        :returns If the writer has been stopped
-        """
-
-        global stop
-
-        if stop.value != 0:
-            return False
-        else:
-            self.__buffer.put(data_point)
-            return True
+        header = "Sensor type,x,y,z,time (ms)\n"
+        self.__f.write(header)
+        return len(header)
 
     def _write_sample(self, sample):
         """
@@ -46,23 +38,9 @@ class FileWriter:
             self._new_file()
 
         self.written += 1
-        self.__f.write(str(sample) + '\n')
-
-    def start_write_loop(self):
-        """
-        Starts consumer loop that writes data points to a file. Runs on consumer process.
-        """
-
-        global stop
-        stop.value = 0
-
-        while True:
-            # This obviously is a very naive implementation of the consumer (while loop instead of lock).
-            # However, this already achieves the maximum sampling rate because the I2C communication with
-            # the sensors is the bottleneck.
-            if not self.__buffer.empty():
-                data_point = self.__buffer.get()
-                self._write_sample(data_point)
+        line = str(sample) + '\n'
+        self.__f.write(line)
+        self.__index.add(line)
 
     def file_size(self):
         """
@@ -76,13 +54,13 @@ class FileWriter:
         files_in_dir = [f for f in listdir(self.path) if isfile(join(self.path, f))]
         max_number = 0
         for f in files_in_dir:
-            if f.startswith('recording_'):
+            if f.startswith('recording_') and f[10:].isdigit():
                 number = int(f[10:])
                 if number > max_number:
                     max_number = number
         filename = 'recording_' + str(max_number + 1)
         self.__f = open(join(self.path, filename), 'w')
-        self._write_header()
+        self.__index = IndexWriter(join(self.path, filename), self._write_header(), self.index_interval)
         self.fname = filename
         self.written = 0
 
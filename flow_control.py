@@ -0,0 +1,341 @@
+"""
+Flow control between the producer and a writer whose consumer can't keep up.
+
+FlowControl sits in front of a writer on the producer process. About once per second it compares the
+writer's backlog (blocks queued but not written yet) with two watermarks and measures the consumer's
+throughput. When the backlog passes half of max_queued, the policy reduces the data sent to the writer:
+
+- 'decimate': low-pass filters every sensor's samples and keeps every factor-th one. The factor is a power
+  of two that brings the sample rate below the consumer's throughput.
+- 'rate': halves the output data rate of the accelerometer through SensorReader.set_accelerometer_rate
+  (down to MIN_RATE), so fewer samples are read in the first place.
+- 'drop_oldest': only the hard limit below.
+
+Once the backlog has been below an eighth of max_queued for recover_after checks, the degradation is undone
+one step at a time. Under any policy the oldest queued blocks are dropped before a new one is put while the
+backlog is at max_queued, so memory stays bounded (a drop can miss while the consumer holds the queue, the
+backlog then exceeds the limit by a few blocks until the next one). Every degradation is written into the stream as a marker sample:
+
+- dropped: x = number of dropped samples, y = time span of the dropped samples (ms)
+- decimated: x = new decimation factor, y = previous factor
+- rate: x = new accelerometer output data rate (Hz), y = previous rate
+
+Markers take the time of the sample that follows them in the stream, so the times don't go backwards when the
+decimated samples (which lag behind by half the filter length) follow them.
+"""
+
+import math
+import operator
+from array import array
+from collections import deque
+
+from sample_block import SampleBlock, GAP, DROPPED, DECIMATED, RATE, STRIDE
+
+POLICIES = ('none', 'drop_oldest', 'decimate', 'rate')
+
+# Largest decimation factor
+MAX_FACTOR = 64
+# Length of the low-pass filter per unit of the decimation factor
+TAPS_PER_FACTOR = 16
+# Cutoff of the low-pass filter relative to the Nyquist frequency after decimation
+CUTOFF = 0.8
+# The sample rate is reduced to this share of the consumer's throughput, which leaves room to work off the backlog
+HEADROOM = 0.8
+CHECK_INTERVAL_MS = 1000.0
+# Lowest accelerometer rate (Hz) of the 'rate' policy, unless the profile's rate is lower
+MIN_RATE = 25.0
+
+
+class FlowControl:
+    """
+    Listener that forwards blocks to a writer (FileWriter or StdoutWriter) and applies a policy when its
+    consumer falls behind
+    """
+
+    def __init__(self, writer, policy='drop_oldest', max_queued=256, recover_after=5, reader=None):
+        """
+
+        :param writer: Writer with on_sensor_block, backlog, consumed_samples and drop_oldest
+        :param policy: One of POLICIES. 'none' only forwards the blocks.
+        :param max_queued: Maximum number of blocks queued for the writer
+        :param recover_after: Number of checks (seconds) the backlog has to stay low before a degradation
+        is undone
+        :param reader: SensorReader, required for the 'rate' policy. As the rate is shared by all writers,
+        use the 'rate' policy for one writer only.
+        """
+        if policy not in POLICIES:
+            raise ValueError("invalid policy [" + str(policy) + "] expected one of " + str(list(POLICIES)))
+        if policy == 'rate' and getattr(reader, 'acc_rate', None) is None:
+            # e.g. a ReplaySource or a schedule without the accelerometer
+            print("Flow control: the output data rate can't be changed, decimating instead")
+            policy = 'decimate'
+        self.writer = writer
+        self.policy = policy
+        self.max_queued = max_queued
+        self.recover_after = recover_after
+        self.reader = reader
+        self.initial_rate = reader.acc_rate if policy == 'rate' else None
+        self.min_rate = min(MIN_RATE, self.initial_rate) if policy == 'rate' else None
+
+        self.factor = 1
+        self.dropped_samples = 0
+        # samples per second received from the producer and written by the consumer, updated by the checks
+        self.input_rate = 0.0
+        self.throughput = 0.0
+
+        self.__decimators = {}
+        # marker and flushed samples as (sensor id, x, y, z, time or None for the time of the next sample)
+        self.__pending = []
+        self.__received = 0
+        self.__calm_checks = 0
+        self.__check_ms = None
+        self.__check_received = 0
+        self.__check_consumed = 0
+
+    def on_sensor_block(self, block):
+        """
+        :returns If the writer has not been stopped
+        """
+        count = block.count
+        if count == 0 or self.policy == 'none':
+            return self.writer.on_sensor_block(block)
+
+        values = block.values
+        self.__received += count
+        t = values[(count - 1) * STRIDE + 3]
+        if self.__check_ms is None:
+            self.__start_checks(t)
+        elif t >= self.__check_ms + CHECK_INTERVAL_MS:
+            self.__check(t)
+
+        # hard limit, independent of the policy
+        dropped = 0
+        first_ms = last_ms = None
+        while self.writer.backlog() >= self.max_queued:
+            item = self.writer.drop_oldest()
+            if item is None:
+                break
+            if isinstance(item, SampleBlock):
+                if item.count == 0:
+                    continue
+                dropped += item.count
+                first = item.values[3]
+                last = item.values[(item.count - 1) * STRIDE + 3]
+            else:
+                dropped += 1
+                first = last = item.time
+            first_ms = first if first_ms is None else min(first_ms, first)
+            last_ms = last if last_ms is None else max(last_ms, last)
+        if dropped:
+            self.dropped_samples += dropped
+            self.__pending.append((DROPPED, float(dropped), last_ms - first_ms, 0.0, None))
+
+        if self.factor == 1 and not self.__pending:
+            return self.writer.on_sensor_block(block)
+        return self.writer.on_sensor_block(self.__output(block))
+
+    def __output(self, block):
+        """
+        :return: New block with the pending markers and samples, followed by the (decimated) samples of block
+        """
+        ids = array('B')
+        out = array('d')
+        # positions of the markers that take the time of the next sample
+        untimed = []
+        for marker in self.__pending:
+            if marker[4] is None:
+                untimed.append(len(ids))
+            ids.append(marker[0])
+            out.extend((marker[1], marker[2], marker[3], 0.0 if marker[4] is None else marker[4]))
+        pending = self.__pending
+        self.__pending = []
+
+        values = block.values
+        sensor_ids = block.sensor_ids
+        if self.factor == 1:
+            ids.extend(sensor_ids[:block.count])
+            out.extend(values[:block.count * STRIDE])
+        else:
+            decimators = self.__decimators
+            for i in range(block.count):
+                sensor = sensor_ids[i]
+                offset = i * STRIDE
+                if sensor >= GAP:
+                    if sensor < DROPPED:
+                        # the sensor was unavailable, the samples before and after the gap aren't filtered together
+                        decimators.pop(sensor - GAP, None)
+                    ids.append(sensor)
+                    out.extend(values[offset:offset + STRIDE])
+                    continue
+                decimator = decimators.get(sensor)
+                if decimator is None:
+                    decimator = decimators[sensor] = _Decimator(self.factor)
+                if decimator.add(values, offset, out):
+                    ids.append(sensor)
+
+        # markers that no sample follows yet (the decimators didn't output one) wait for the next block
+        while untimed and untimed[-1] == len(ids) - 1:
+            position = untimed.pop()
+            self.__pending.insert(0, pending[position])
+            ids.pop()
+            del out[position * STRIDE:]
+        for position in reversed(untimed):
+            out[position * STRIDE + 3] = out[(position + 1) * STRIDE + 3]
+
+        return SampleBlock.from_arrays(ids, out)
+
+    def __start_checks(self, t):
+        self.__check_ms = t
+        self.__check_received = self.__received
+        self.__check_consumed = self.writer.consumed_samples()
+
+    def __check(self, t):
+        """
+        Measures the rates and degrades or recovers depending on the backlog. Called about once per second.
+        """
+        consumed = self.writer.consumed_samples()
+        seconds = (t - self.__check_ms) / 1000.0
+        self.input_rate = (self.__received - self.__check_received) / seconds
+        self.throughput = (consumed - self.__check_consumed) / seconds
+        self.__check_ms = t
+        self.__check_received = self.__received
+        self.__check_consumed = consumed
+
+        backlog = self.writer.backlog()
+        if backlog >= self.max_queued // 2:
+            self.__calm_checks = 0
+            self.__degrade()
+        elif backlog <= self.max_queued // 8:
+            self.__calm_checks += 1
+            if self.__calm_checks >= self.recover_after:
+                self.__calm_checks = 0
+                self.__recover()
+        else:
+            self.__calm_checks = 0
+
+    def __degrade(self):
+        if self.policy == 'decimate':
+            factor = min(self.factor * 2, MAX_FACTOR)
+            if self.throughput > 0:
+                while factor < MAX_FACTOR and self.input_rate / factor > HEADROOM * self.throughput:
+                    factor *= 2
+            self.__set_factor(factor)
+        elif self.policy == 'rate':
+            # one step per check: every step takes recover_after checks to undo, and a consumer that wrote
+            # nothing during a check (e.g. a stalled SD card) says nothing about the rate it can take
+            self.__set_rate(max(self.reader.acc_rate / 2.0, self.min_rate))
+
+    def __recover(self):
+        if self.policy == 'decimate':
+            self.__set_factor(max(self.factor // 2, 1))
+        elif self.policy == 'rate':
+            self.__set_rate(min(self.reader.acc_rate * 2, self.initial_rate))
+
+    def __set_factor(self, factor):
+        if factor == self.factor:
+            return
+        print('Flow control: decimation factor ' + str(self.factor) + ' -> ' + str(factor) + ' (consumer writes ' +
+              str(int(self.throughput)) + ' samples/sec, ' + str(int(self.input_rate)) + ' received)')
+        self.__pending.append((DECIMATED, float(factor), float(self.factor), 0.0, None))
+        if factor == 1:
+            # samples after the last filtered one would otherwise be lost
+            for sensor, decimator in sorted(self.__decimators.items()):
+                self.__pending.extend(decimator.unfiltered(sensor))
+            self.__decimators = {}
+        else:
+            for decimator in self.__decimators.values():
+                decimator.set_factor(factor)
+        self.factor = factor
+
+    def __set_rate(self, hz):
+        previous = self.reader.acc_rate
+        rate = self.reader.set_accelerometer_rate(hz)
+        if rate is None or rate == previous:
+            return
+        print('Flow control: accelerometer rate ' + str(previous) + ' -> ' + str(rate) + ' Hz (consumer writes ' +
+              str(int(self.throughput)) + ' samples/sec, ' + str(int(self.input_rate)) + ' received)')
+        self.__pending.append((RATE, float(rate), float(previous), 0.0, None))
+
+
+class _Decimator:
+    """
+    Low-pass filter and downsampling of the samples of one sensor. Only every factor-th output of the
+    filter is computed.
+    """
+
+    def __init__(self, factor):
+        self.x = deque()
+        self.y = deque()
+        self.z = deque()
+        self.t = deque()
+        self.phase = 0
+        # number of samples added since the last output, None before the first output
+        self.since_output = None
+        self.set_factor(factor)
+
+    def set_factor(self, factor):
+        self.factor = factor
+        self.taps = lowpass_taps(factor)
+        n = len(self.taps)
+        # the history is kept, so the filter doesn't have to fill up again
+        self.x = deque(self.x, n)
+        self.y = deque(self.y, n)
+        self.z = deque(self.z, n)
+        self.t = deque(self.t, n)
+        self.phase = 0
+
+    def add(self, values, offset, out):
+        """
+        Adds the sample at offset of values and appends a filtered sample to out if one is due
+        :return: If a sample was appended
+        """
+        self.x.append(values[offset])
+        self.y.append(values[offset + 1])
+        self.z.append(values[offset + 2])
+        self.t.append(values[offset + 3])
+        if self.since_output is not None:
+            self.since_output += 1
+        taps = self.taps
+        if len(self.t) < len(taps):
+            return False
+        self.phase += 1
+        if self.phase < self.factor:
+            return False
+        self.phase = 0
+        self.since_output = 0
+        mul = operator.mul
+        # linear phase filter: the output belongs to the time of the center of the window
+        out.extend((sum(map(mul, taps, self.x)), sum(map(mul, taps, self.y)), sum(map(mul, taps, self.z)),
+                    self.t[len(taps) // 2]))
+        return True
+
+    def unfiltered(self, sensor):
+        """
+        :return: The samples after the center of the last output as (sensor id, x, y, z, time)
+        """
+        n = len(self.t)
+        if self.since_output is not None:
+            n = min(n, len(self.taps) // 2 + self.since_output)
+        start = len(self.t) - n
+        return [(sensor, self.x[i], self.y[i], self.z[i], self.t[i]) for i in range(start, len(self.t))]
+
+
+def lowpass_taps(factor):
+    """
+    Windowed-sinc (Hamming) low-pass filter for decimation by factor, with unit gain at 0 Hz
+    :return: TAPS_PER_FACTOR * factor + 1 coefficients
+    """
+    n = TAPS_PER_FACTOR * factor + 1
+    center = n // 2
+    # cutoff in cycles per sample
+    cutoff = CUTOFF * 0.5 / factor
+    taps = []
+    for i in range(n):
+        k = i - center
+        if k == 0:
+            h = 2 * cutoff
+        else:
+            h = math.sin(2 * math.pi * cutoff * k) / (math.pi * k)
+        taps.append(h * (0.54 - 0.46 * math.cos(2 * math.pi * i / (n - 1))))
+    total = sum(taps)
+    return [h / total for h in taps]
@@ -6,11 +6,12 @@
 # but uses smbus rather than quick2wire and sets some different init
 # params.
 
-import smbus
 import math
 import time
 import sys
 
+NAN = float('nan')
+
 
 class HMC5883L:
     __scales = {
@@ -24,8 +25,18 @@ class HMC5883L:
         8.10: [7, 4.35],
     }
 
-    def __init__(self, port=1, address=0x1E, gauss=1.3, declination=(0, 0)):
-        self.bus = smbus.SMBus(port)
+    # Data output rate (Hz) and number of averaged samples: code in configuration register A
+    rates = {0.75: 0, 1.5: 1, 3: 2, 7.5: 3, 15: 4, 30: 5, 75: 6}
+    averaged_samples = {1: 0, 2: 1, 4: 2, 8: 3}
+
+    # Scale (mG/LSB) per gauss range
+    scales = dict((gauss, scale) for gauss, (reg, scale) in __scales.items())
+
+    def __init__(self, port=1, address=0x1E, gauss=1.3, declination=(0, 0), bus=None, rate=15, samples=8):
+        if bus is None:
+            import smbus
+            bus = smbus.SMBus(port)
+        self.bus = bus
         self.address = address
 
         (degrees, minutes) = declination
@@ -33,9 +44,19 @@ class HMC5883L:
         self.__declMinutes = minutes
         self.__declination = (degrees + minutes / 60) * math.pi / 180
 
-        (reg, self.__scale) = self.__scales[gauss]
-        self.bus.write_byte_data(self.address, 0x00, 0x70)  # 8 Average, 15 Hz, normal measurement
-        self.bus.write_byte_data(self.address, 0x01, reg << 5)  # Scale
+        (self.__scale_reg, self.__scale) = self.__scales[gauss]
+        if rate not in self.rates:
+            raise ValueError("invalid rate [" + str(rate) + "] expected one of " + str(sorted(self.rates)))
+        if samples not in self.averaged_samples:
+            raise ValueError("invalid samples [" + str(samples) + "] expected one of " +
+                             str(sorted(self.averaged_samples)))
+        self.__config_a = (self.averaged_samples[samples] << 5) | (self.rates[rate] << 2)
+        self.configure()
+
+    def configure(self):
+        """Write the measurement configuration to the device (also used to restore it after a brownout)"""
+        self.bus.write_byte_data(self.address, 0x00, self.__config_a)  # Averaging, rate, normal measurement
+        self.bus.write_byte_data(self.address, 0x01, self.__scale_reg << 5)  # Scale
         self.bus.write_byte_data(self.address, 0x02, 0x00)  # Continuous measurement
 
     def declination(self):
@@ -60,8 +81,25 @@ class HMC5883L:
         z = self.__convert(data, 5)
         return (x, y, z)
 
-    def heading(self):
-        (x, y, z) = self.read_data()
+    def read_data_into(self, out, offset=0):
+        # Like read_data, but writes x, y, z to out[offset:offset + 3]. Overflowed axes are NaN.
+        data = self.bus.read_i2c_block_data(self.address, 0x00)
+        x = self.__convert(data, 3)
+        y = self.__convert(data, 7)
+        z = self.__convert(data, 5)
+        out[offset] = NAN if x is None else x
+        out[offset + 1] = NAN if y is None else y
+        out[offset + 2] = NAN if z is None else z
+        return out
+
+    def declination_radians(self):
+        return self.__declination
+
+    def heading(self, data=None):
+        # data: an already read (x, y, z) sample, otherwise the device is read
+        if data is None:
+            data = self.read_data()
+        (x, y, z) = data
         headingRad = math.atan2(y, x)
         headingRad += self.__declination
 
@@ -77,18 +115,25 @@ class HMC5883L:
         headingDeg = headingRad * 180 / math.pi
         return headingDeg
 
+    def headings(self, mag, acc):
+        # Tilt-compensated headings in degrees for a batch of already read compass samples (n x 3)
+        # and the accelerometer samples (n x 3) taken at the same times, see heading.tilt_compensated_heading
+        from hmc5883l.heading import tilt_compensated_heading
+        return tilt_compensated_heading(mag, acc, self.__declination)
+
     def degrees(self, headingDeg):
         degrees = math.floor(headingDeg[0])
         minutes = round((headingDeg[1] - degrees) * 60)
         return (degrees, minutes)
 
     def __str__(self):
-        (x, y, z) = self.read_data()
+        data = self.read_data()
+        (x, y, z) = data
         return "Axis X: " + str(x) + "\n" + \
                "Axis Y: " + str(y) + "\n" + \
                "Axis Z: " + str(z) + "\n" + \
                "Declination: " + str(self.degrees(self.declination())) + "\n" + \
-               "Heading: " + str(self.heading()) + "\n"
+               "Heading: " + str(self.heading(data)) + "\n"
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+"""
+Compass headings for batches of already acquired samples, vectorised with numpy.
+
+Unlike HMC5883L.heading() this doesn't touch the bus: the compass and accelerometer samples come from
+the acquisition stream (e.g. a SampleBlock), so one call computes the headings of a whole batch.
+The heading is tilt compensated: the accelerometer gives the direction of gravity, and the magnetic
+field is projected onto the horizontal plane before the angle is computed. Both sensors are assumed to
+have the same axis orientation (as on the GY-85 board).
+"""
+
+import numpy as np
+
+from sample_block import ACC, COMP, STRIDE
+
+
+def tilt_compensated_heading(mag, acc, declination=0.0):
+    """
+    :param mag: Compass samples, array-like of shape (n, 3). Overflowed axes (None in read_data) should be NaN.
+    :param acc: Accelerometer samples taken at the same times, shape (n, 3), or a single sample of shape (3,)
+    if the device didn't move. Any unit, only the direction is used.
+    :param declination: Magnetic declination in radians (see HMC5883L.declination_radians)
+    :return: Headings in degrees in [0, 360), NaN where a compass axis overflowed. For a level device
+    this is the same as HMC5883L.heading().
+    """
+    mag = np.asarray(mag, dtype=np.float64)
+    acc = np.asarray(acc, dtype=np.float64)
+    mx, my, mz = mag[..., 0], mag[..., 1], mag[..., 2]
+    ax, ay, az = acc[..., 0], acc[..., 1], acc[..., 2]
+
+    roll = np.arctan2(ay, az)
+    sin_roll = np.sin(roll)
+    cos_roll = np.cos(roll)
+    pitch = np.arctan2(-ax, ay * sin_roll + az * cos_roll)
+    sin_pitch = np.sin(pitch)
+    cos_pitch = np.cos(pitch)
+
+    # magnetic field in the horizontal plane
+    xh = mx * cos_pitch + (my * sin_roll + mz * cos_roll) * sin_pitch
+    yh = my * cos_roll - mz * sin_roll
+
+    heading = np.mod(np.arctan2(yh, xh) + declination, 2 * np.pi)
+    return np.degrees(heading)
+
+
+def block_headings(block, declination=0.0):
+    """
+    Headings for all compass samples of a SampleBlock. Every compass sample is paired with the last
+    accelerometer sample before it (so the schedule must read the accelerometer before the compass,
+    as FULL_SCHEDULE does).
+    :return: Tuple (times in ms, headings in degrees) of the compass samples. Headings are NaN for compass
+    samples without a preceding accelerometer sample in the block.
+    """
+    ids = np.frombuffer(block.sensor_ids, dtype=np.uint8)[:block.count]
+    values = np.frombuffer(block.values, dtype=np.float64)[:block.count * STRIDE].reshape(-1, STRIDE)
+
+    comp = np.flatnonzero(ids == COMP)
+    acc = np.flatnonzero(ids == ACC)
+    if len(comp) == 0:
+        return np.empty(0), np.empty(0)
+    if len(acc) == 0:
+        return values[comp, 3], np.full(len(comp), np.nan)
+
+    previous = np.searchsorted(acc, comp) - 1
+    headings = tilt_compensated_heading(values[comp, :3], values[acc[np.maximum(previous, 0)], :3], declination)
+    headings[previous < 0] = np.nan
+    return values[comp, 3], headings
@@ -19,9 +19,6 @@
 # along with this program.  If not, see http://www.gnu.org/licenses/.
 #
 
-import smbus
-
-
 def int_sw_swap(x):
     """Interpret integer as signed word with bytes swapped"""
     xl = x & 0xff
@@ -35,14 +32,26 @@ class ITG3200(object):
     Supports data polling at the moment.
     """
 
-    def __init__(self, bus_nr=1, addr=0x68):
+    # sensitivity with FS_SEL 0x03, the only valid full scale setting
+    LSB_PER_DPS = 14.375
+
+    def __init__(self, bus_nr=1, addr=0x68, bus=None, lpf=0, div=8):
         """ Sensor class constructor
         Params:
             bus_nr .. I2C bus number
             addr   .. ITG3200 device address
+            bus    .. already opened bus object (e.g. a SimulatedBus),
+                      smbus.SMBus(bus_nr) is opened if None
+            lpf    .. low pass filter code used by default_init (see sample_rate)
+            div    .. sample rate divider used by default_init (see sample_rate)
         """
-        self.bus = smbus.SMBus(bus_nr)
+        if bus is None:
+            import smbus
+            bus = smbus.SMBus(bus_nr)
+        self.bus = bus
         self.addr = addr
+        self.lpf = lpf
+        self.div = div
         self.default_init()
 
     def sample_rate(self, lpf, div):
@@ -68,11 +77,20 @@ class ITG3200(object):
         self.bus.write_byte_data(self.addr, 0x15, div - 1)
         self.bus.write_byte_data(self.addr, 0x16, 0x18 | lpf)
 
+    @staticmethod
+    def output_rate(lpf, div):
+        """Output data rate in Hz for a low pass filter code and divider
+        as set by sample_rate: 8kHz internal sample rate with the 256Hz
+        low pass filter, 1kHz otherwise, divided by div.
+        """
+        internal_rate = 8000.0 if lpf == 0 else 1000.0
+        return internal_rate / div
+
     def default_init(self):
-        """Initialization with default values:
+        """Initialization with the values passed to the constructor, by default:
         8kHz internal sample rate, 256Hz low pass filter, sample rate divider 8.
         """
-        self.sample_rate(0, 8)
+        self.sample_rate(self.lpf, self.div)
 
     def read_data(self):
         """Read and return data tuple for x, y and z axis
@@ -84,6 +102,16 @@ class ITG3200(object):
 
         return (gx, gy, gz)
 
+    def read_data_into(self, out, offset=0):
+        """Like read_data, but writes x, y and z to out[offset:offset + 3]
+        instead of returning a new tuple. Returns out.
+        """
+        read_word_data = self.bus.read_word_data
+        out[offset] = int_sw_swap(read_word_data(self.addr, 0x1d))
+        out[offset + 1] = int_sw_swap(read_word_data(self.addr, 0x1f))
+        out[offset + 2] = int_sw_swap(read_word_data(self.addr, 0x21))
+        return out
+
 
 if __name__ == '__main__':
     import time
@@ -92,5 +120,5 @@ if __name__ == '__main__':
 
     while True:
         gx, gy, gz = sensor.read_data()
-        print gx, gy, gz
+        print(gx, gy, gz)
         time.sleep(1)
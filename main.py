@@ -1,41 +1,146 @@
 from multiprocessing import Process
 
+import os
 import sys
 import argparse
-import file_writer
-import stdout_writer
-from stdout_writer import StdoutWriter
-from sensor_reader import SensorReader
-from file_writer import FileWriter
+from acquisition_profile import load_profile
+
+# Everything else is imported when the configuration needs it, which keeps restarts fast on small boards
 
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--stdout", help="write to stdout instead of file", action="store_true")
+parser.add_argument("--profile", help="acquisition profile (.json or .toml) with sensor settings and writers, "
+                                      "see profiles/")
+parser.add_argument("--stdout", help="write to stdout instead of the profile's writers", action="store_true")
 parser.add_argument("-nth", type=int, help="only print ever nth sample if --stdout is specified")
+parser.add_argument("--producer-cpu", type=int, help="pin the sensor reader to this core")
+parser.add_argument("--consumer-cpu", type=int, help="pin the writer processes to this core")
+parser.add_argument("--rt-priority", type=int,
+                    help="run the sensor reader with SCHED_FIFO and this priority (1-99, needs CAP_SYS_NICE)")
+parser.add_argument("--mlock", help="lock the memory of the sensor reader into RAM", action="store_true")
+parser.add_argument("--manual-gc", help="disable the garbage collector in the sensor reader loop and collect "
+                                        "once per second instead", action="store_true")
+parser.add_argument("--replay", help="replay this recording instead of reading from the sensors")
+parser.add_argument("--speed", type=float, default=1.0,
+                    help="replay speed relative to the recording if --replay is specified, 0 for maximum speed")
+parser.add_argument("--coordinator", help="HOST[:PORT] of capture_coordinator.py, to start the recording together "
+                                          "with other nodes and write clock corrections for merge_recordings.py")
+parser.add_argument("--node", help="name of this node if --coordinator is specified, the host name by default")
+parser.add_argument("--sync-interval", type=float, default=10.0,
+                    help="seconds between clock synchronizations while recording if --coordinator is specified")
+parser.add_argument("--sync-file", help="clock correction file if --coordinator is specified, by default "
+                                        "sync_<node>_<epoch>.json next to the recordings")
 args = parser.parse_args()
+if args.coordinator is not None and args.replay is not None:
+    parser.error("--coordinator can't be combined with --replay")
+
+# fails before anything is started if the profile is invalid
+profile = load_profile(args.profile)
+print(profile.describe())
 
+if args.replay is not None:
+    from replay_source import ReplaySource
+    sensor_reader = ReplaySource(args.replay, speed=args.speed, block_size=profile.block_size)
+else:
+    from sensor_reader import SensorReader
+    sensor_reader = SensorReader(manual_gc=args.manual_gc, profile=profile)
 
-sensor_reader = SensorReader()
+writer_configs = profile.writers
 if args.stdout:
-    if args.nth is not None:
-        writer = StdoutWriter(args.nth)
+    writer_configs = [{'type': 'stdout', 'nth': args.nth if args.nth is not None else 1}]
+
+writers = []
+for config in writer_configs:
+    if config['type'] == 'stdout':
+        import stdout_writer
+        from stdout_writer import StdoutWriter
+        writers.append(StdoutWriter(config.get('nth', 1), queue_size=profile.queue_size))
+        # reset this because sensor_reader.start_reading() might execute before writer.start_write_loop()
+        stdout_writer.stop.value = 0
     else:
-        writer = StdoutWriter()
+        import file_writer
+        from file_writer import FileWriter
+        writers.append(FileWriter(config['path'], config.get('index_interval', 1024), queue_size=profile.queue_size))
+        file_writer.stop.value = 0
+
+# bounds the queues and degrades the stream when a writer falls behind
+listeners = writers
+if profile.flow_policy != 'none':
+    from flow_control import FlowControl
+    listeners = [FlowControl(writer, profile.flow_policy, profile.max_queued, profile.recover_after,
+                             reader=sensor_reader) for writer in writers]
+
+if len(listeners) == 1:
+    listener = listeners[0]
 else:
-    writer = FileWriter('/home/pi/sensor_recordings/')
-sensor_reader.set_sensor_listener(writer)
+    from fan_out import FanOut
+    listener = FanOut(listeners)
+
+# sees all samples, before flow control might decimate or drop them
+detector = None
+if profile.anomaly['enabled']:
+    from anomaly_detector import AnomalyDetector
+    anomaly = dict(profile.anomaly)
+    del anomaly['enabled']
+    detector = AnomalyDetector(listener, **anomaly)
+    listener = detector
+sensor_reader.set_sensor_listener(listener)
 
 # Consumer/producer architecture: the SensorReader is the producer, reading data from sensors,
-# and the FileWriter is the consumer.
+# and the writers are the consumers (one process each).
 # We use multiprocessing.Process instead of threading.Thread because the latter would also cause
 # the other thread to slow down due to Global Interpreter Lock.
 
-# reset this because sensor_reader.start_reading() might execute before file_writer.start_write_loop()
-if args.stdout:
-    stdout_writer.stop.value = 0
-else:
-    file_writer.stop.value = 0
-process = Process(target=writer.start_write_loop)
-process.start()
 
-sensor_reader.start_reading()
+def start_consumer(writer):
+    if args.consumer_cpu is not None:
+        import realtime
+        realtime.pin_to_cpus([args.consumer_cpu])
+    writer.start_write_loop()
+
+
+processes = [Process(target=start_consumer, args=(writer,)) for writer in writers]
+for process in processes:
+    process.start()
+
+# with a coordinator, all nodes start on its epoch and the offset of the local clock is measured while recording
+start_ms = None
+if args.coordinator is not None:
+    from time_sync import SyncClient, parse_address
+    node = args.node or os.uname().nodename
+    sync_client = SyncClient(parse_address(args.coordinator), node)
+    print('Waiting for the start signal of ' + args.coordinator)
+    epoch_ms = sync_client.wait_for_epoch()
+    start_ms = sync_client.local_time(epoch_ms)
+    sync_file = args.sync_file
+    if sync_file is None:
+        directories = [config['path'] for config in writer_configs if config['type'] == 'file']
+        sync_file = os.path.join(directories[0] if directories else '.',
+                                 'sync_' + node + '_' + str(int(epoch_ms)) + '.json')
+    print('Writing clock corrections to ' + sync_file)
+    sync_process = Process(target=sync_client.run, args=(sync_file, epoch_ms, start_ms, args.sync_interval))
+    sync_process.start()
+    processes.append(sync_process)
+
+# only after forking, so the consumer doesn't inherit the producer's scheduling settings
+if args.producer_cpu is not None or args.rt_priority is not None or args.mlock:
+    import realtime
+    realtime.apply(cpus=None if args.producer_cpu is None else [args.producer_cpu],
+                   priority=args.rt_priority, lock=args.mlock)
+
+try:
+    if start_ms is None:
+        sensor_reader.start_reading()
+    else:
+        sensor_reader.start_reading(start_ms)
+finally:
+    # otherwise the consumers keep spinning after the producer is gone
+    for process in processes:
+        process.terminate()
+    # and the producer would wait at exit for the queued items to be written to the terminated consumers
+    for writer in writers:
+        writer.close()
+    # closes the alerts file
+    if detector is not None:
+        detector.close()
+
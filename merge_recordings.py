@@ -0,0 +1,19 @@
+import argparse
+
+from time_sync import REORDER_MS, merge
+
+# Merges the recordings of a capture with several nodes into one file, with the sample times of all nodes
+# on the coordinator's clock (ms since the shared epoch).
+# Example: python merge_recordings.py merged.csv --node pi1/recording_3 pi1/sync_pi1.json \
+#                                                --node pi2/recording_7 pi2/sync_pi2.json
+
+parser = argparse.ArgumentParser()
+parser.add_argument("output", help="merged file")
+parser.add_argument("--node", nargs=2, action="append", required=True, metavar=("RECORDING", "SYNC_FILE"),
+                    help="recording of a node and the sync metadata written next to it")
+parser.add_argument("--reorder-ms", type=float, default=REORDER_MS,
+                    help="how much older (ms) a sample may be than samples before it in the same recording")
+args = parser.parse_args()
+
+count = merge(args.output, args.node, args.reorder_ms)
+print('Merged ' + str(count) + ' samples of ' + str(len(args.node)) + ' nodes into ' + args.output)
@@ -0,0 +1,77 @@
+"""
+Options to make the timing of the acquisition loop more deterministic (Linux only): CPU pinning,
+SCHED_FIFO priority and locking memory. Every function prints a warning and returns False if the
+option is not supported or not permitted (e.g. missing CAP_SYS_NICE), so acquisition still runs.
+"""
+
+import ctypes
+import ctypes.util
+import os
+
+# from <sys/mman.h>
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def pin_to_cpus(cpus, pid=0):
+    """
+    Restricts a process to the given cores
+    :param cpus: Iterable of core numbers
+    :param pid: Process id, 0 is the calling process
+    :return: If it succeeded
+    """
+    try:
+        os.sched_setaffinity(pid, set(cpus))
+    except (AttributeError, OSError) as e:
+        print('Could not pin process to cpus ' + str(sorted(cpus)) + ': ' + str(e))
+        return False
+    return True
+
+
+def set_realtime_priority(priority, pid=0):
+    """
+    Switches a process to the SCHED_FIFO scheduling policy
+    :param priority: Real-time priority between 1 and 99
+    :param pid: Process id, 0 is the calling process
+    :return: If it succeeded
+    """
+    if not 1 <= priority <= 99:
+        raise ValueError("invalid priority [" + str(priority) + "] expected 1 to 99")
+    try:
+        os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, OSError) as e:
+        print('Could not set SCHED_FIFO priority ' + str(priority) + ': ' + str(e))
+        return False
+    return True
+
+
+def lock_memory():
+    """
+    Locks all current and future pages of the calling process into RAM (mlockall), so the
+    acquisition loop never waits for a page fault
+    :return: If it succeeded
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        result = libc.mlockall(MCL_CURRENT | MCL_FUTURE)
+    except (AttributeError, OSError) as e:
+        print('Could not lock memory: ' + str(e))
+        return False
+    if result != 0:
+        errno = ctypes.get_errno()
+        print('Could not lock memory: ' + os.strerror(errno))
+        return False
+    return True
+
+
+def apply(cpus=None, priority=None, lock=False):
+    """
+    Applies the options to the calling process. None/False leaves the respective setting unchanged.
+    Note that memory locks are not inherited by child processes, so this has to be called in each process.
+    """
+    if cpus is not None:
+        pin_to_cpus(cpus)
+    if priority is not None:
+        set_realtime_priority(priority)
+    if lock:
+        lock_memory()
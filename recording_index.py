@@ -0,0 +1,256 @@
+"""
+Sparse time index for recordings written by FileWriter.
+
+Next to every recording_N a sidecar file recording_N.idx stores one entry per chunk of K samples:
+the byte offset and length of the chunk in the recording, the number of its first sample, its number
+of samples and the minimum and maximum time in the chunk. A query for a time window binary searches
+the entries, seeks to the first chunk that can contain it and only reads until the end of the last one that
+can. The times don't have to be in order (e.g. markers or decimated samples may be slightly older than the
+samples before them).
+"""
+
+from io import BytesIO
+from os import listdir, stat
+from os.path import isfile, join
+
+import numpy as np
+
+from data_point import DataPoint
+
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = "offset,length,first sample,samples,min time (ms),max time (ms)\n"
+
+# RecordingIndex and index file version (mtime, size) by recording path, see load_index
+_indexes = {}
+
+
+class IndexWriter:
+    """
+    Builds the index while a recording is written. Runs on the consumer process.
+    """
+
+    def __init__(self, recording_path, offset, interval=1024):
+        """
+
+        :param recording_path: Path of the recording
+        :param offset: Byte offset in the recording at which the first sample will be written
+        :param interval: Number of samples per index entry
+        """
+        self.interval = interval
+        self.offset = offset
+        self.samples = 0
+        self.__f = open(recording_path + INDEX_SUFFIX, 'w')
+        self.__f.write(INDEX_HEADER)
+        self.__f.flush()
+        self.__chunk_offset = offset
+        self.__chunk_first = 0
+        self.__chunk_samples = 0
+        self.__t_min = 0.0
+        self.__t_max = 0.0
+
+    def add(self, line):
+        """
+        :param line: Line of a sample as written to the recording (including the line break)
+        """
+        t = float(line[line.rindex(',') + 1:])
+        if self.__chunk_samples == 0:
+            self.__chunk_offset = self.offset
+            self.__chunk_first = self.samples
+            self.__t_min = t
+            self.__t_max = t
+        elif t < self.__t_min:
+            self.__t_min = t
+        elif t > self.__t_max:
+            self.__t_max = t
+        self.offset += len(line)
+        self.samples += 1
+        self.__chunk_samples += 1
+        if self.__chunk_samples == self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the entry of the current (possibly incomplete) chunk
+        """
+        if self.__chunk_samples == 0:
+            return
+        self.__f.write(str(self.__chunk_offset) + ',' + str(self.offset - self.__chunk_offset) + ',' +
+                       str(self.__chunk_first) + ',' +
+                       str(self.__chunk_samples) + ',' + repr(self.__t_min) + ',' + repr(self.__t_max) + '\n')
+        self.__f.flush()
+        self.__chunk_samples = 0
+
+    def close(self):
+        self.flush()
+        self.__f.close()
+
+
+class RecordingIndex:
+    """
+    Index of a single recording, loaded from its sidecar file
+    """
+
+    def __init__(self, recording_path):
+        self.recording_path = recording_path
+        entries = np.empty((0, 6))
+
+        index_path = recording_path + INDEX_SUFFIX
+        if isfile(index_path):
+            with open(index_path, 'rb') as f:
+                f.readline()
+                data = f.read()
+            # an entry without a line break is still being written
+            data = data[:data.rfind(b'\n') + 1]
+            if data:
+                try:
+                    entries = np.loadtxt(BytesIO(data), delimiter=',', ndmin=2)
+                except ValueError:
+                    entries = _parse_entries(data)
+
+        self.offsets = entries[:, 0].astype(np.int64)
+        self.lengths = entries[:, 1].astype(np.int64)
+        self.first_samples = entries[:, 2].astype(np.int64)
+        self.samples = entries[:, 3].astype(np.int64)
+        self.t_min = entries[:, 4].copy()
+        self.t_max = entries[:, 5].copy()
+
+        # ascending even if the times aren't: maximum time up to and minimum time from every chunk on
+        self.__t_max_so_far = np.maximum.accumulate(self.t_max)
+        self.__t_min_from = np.minimum.accumulate(self.t_min[::-1])[::-1]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def indexed_end(self):
+        """
+        :return: Byte offset in the recording after the last indexed chunk, or None if nothing is indexed
+        """
+        if len(self.offsets) == 0:
+            return None
+        return int(self.offsets[-1] + self.lengths[-1])
+
+    def query(self, t0, t1, sensor_type=None):
+        """
+        Generator of the DataPoints with t0 <= time <= t1, in the order of the recording.
+        Samples after the last indexed chunk (e.g. of a recording in progress) are scanned.
+        :param sensor_type: Only return samples of this type (e.g. 'acc')
+        """
+        if sensor_type is not None:
+            prefix = (sensor_type + ',').encode('ascii')
+        else:
+            prefix = b''
+
+        with open(self.recording_path, 'rb') as f:
+            if len(self.offsets) == 0:
+                f.readline()
+                for data_point in _scan(f, t0, t1, prefix):
+                    yield data_point
+                return
+
+            # the first chunk with a time >= t0 and the last one with a time <= t1
+            first = int(np.searchsorted(self.__t_max_so_far, t0, 'left'))
+            last = int(np.searchsorted(self.__t_min_from, t1, 'right')) - 1
+            if first <= last:
+                start = int(self.offsets[first])
+                end = int(self.offsets[last] + self.lengths[last])
+                f.seek(start)
+                for data_point in _scan(f, t0, t1, prefix, end - start):
+                    yield data_point
+            f.seek(self.indexed_end())
+            for data_point in _scan(f, t0, t1, prefix):
+                yield data_point
+
+
+def _scan(f, t0, t1, prefix, length=None):
+    """
+    Generator of the DataPoints with t0 <= time <= t1 from the current position of f
+    :param length: Number of bytes to read, None reads to the end
+    """
+    for line in f:
+        if line.startswith(prefix):
+            data_point = DataPoint.from_str(line.decode('ascii').rstrip('\n'))
+            if data_point is not None and t0 <= data_point.time <= t1:
+                yield data_point
+        if length is not None:
+            length -= len(line)
+            if length <= 0:
+                return
+
+
+def _parse_entries(data):
+    """
+    Parses the entries line by line up to the first malformed one
+    :return: Array with one row per entry
+    """
+    rows = []
+    for line in data.split(b'\n'):
+        comps = line.split(b',')
+        if len(comps) != 6:
+            break
+        try:
+            rows.append([float(comp) for comp in comps])
+        except ValueError:
+            break
+    return np.array(rows).reshape(-1, 6)
+
+
+def _time_of(line):
+    try:
+        return float(line[line.rindex(b',') + 1:])
+    except ValueError:
+        return None
+
+
+def recordings(directory):
+    """
+    :return: Paths of the recordings in a directory, ordered by sequence number
+    """
+    numbered = []
+    for f in listdir(directory):
+        if f.startswith('recording_') and f[10:].isdigit() and isfile(join(directory, f)):
+            numbered.append((int(f[10:]), join(directory, f)))
+    return [path for number, path in sorted(numbered)]
+
+
+def load_index(recording_path):
+    """
+    :return: RecordingIndex of a recording, loaded again only if its index file has changed since the last call
+    """
+    index_path = recording_path + INDEX_SUFFIX
+    if isfile(index_path):
+        info = stat(index_path)
+        version = (info.st_mtime_ns, info.st_size)
+    else:
+        version = None
+    cached = _indexes.get(recording_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    index = RecordingIndex(recording_path)
+    _indexes[recording_path] = (version, index)
+    return index
+
+
+def query(directory, t0, t1, sensor_type=None):
+    """
+    Generator of (recording path, DataPoint) for the samples with t0 <= time <= t1 in all recordings of a
+    directory. Times are those stored in the recordings (ms since the start of the respective recording).
+    """
+    for path in recordings(directory):
+        for data_point in load_index(path).query(t0, t1, sensor_type):
+            yield path, data_point
+
+
+def build_index(recording_path, interval=1024):
+    """
+    Creates the index of an existing recording (e.g. one written before indexing existed)
+    """
+    with open(recording_path, 'rb') as f:
+        header = f.readline()
+        writer = IndexWriter(recording_path, len(header), interval)
+        for line in f:
+            if _time_of(line) is None:
+                writer.offset += len(line)
+                continue
+            writer.add(line.decode('ascii'))
+        writer.close()
+    return RecordingIndex(recording_path)
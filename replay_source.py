@@ -0,0 +1,231 @@
+import io
+import mmap
+import time
+from array import array
+
+import numpy as np
+
+from sample_block import SampleBlock, SENSOR_NAMES, STRIDE
+from source_base import SourceBase
+
+SENSOR_IDS = dict((name.encode('ascii'), i) for i, name in enumerate(SENSOR_NAMES))
+
+NEWLINE = ord('\n')
+COMMA = ord(',')
+# (length << 16 | first character << 8 | last character) of the sensor names, sorted, and the sensor ids
+_keys = sorted((len(name) << 16 | ord(name[0]) << 8 | ord(name[-1]), i) for i, name in enumerate(SENSOR_NAMES))
+NAME_KEYS = np.array([key for key, i in _keys], dtype=np.int64)
+NAME_IDS = np.array([i for key, i in _keys], dtype=np.uint8)
+
+
+class ReplaySource(SourceBase):
+    """
+    Replays a recording written by FileWriter to a listener, with the same interface as SensorReader.
+    Samples keep their recorded timestamps and are passed on at the original pace, N times faster or as
+    fast as possible.
+    """
+
+    def __init__(self, path, speed=1.0, block_size=64, chunk_size=1 << 20, preload=False):
+        """
+
+        :param path: Recording file
+        :param speed: Replay speed relative to the recording. None or 0 replays as fast as possible.
+        :param block_size: Maximum number of samples that are passed to block-aware listeners at once
+        :param chunk_size: Number of bytes of the file that are parsed at once
+        :param preload: Parse the whole file into memory once, so replaying is not limited by parsing
+        (e.g. for load tests of the consumer that replay the same file repeatedly)
+        """
+        SourceBase.__init__(self)
+        self.__stopped = True
+        self.path = path
+        self.speed = speed
+        self.block = SampleBlock(block_size)
+        self.chunk_size = chunk_size
+        self.preload = preload
+        self.__loaded = None
+        self.samples_per_sec = 0
+        self.read_samples = 0
+
+    def _chunks(self):
+        """
+        Generator of (sensor ids, values) arrays parsed from consecutive parts of the file
+        """
+        if self.__loaded is not None:
+            yield self.__loaded
+            return
+
+        with open(self.path, 'rb') as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                return
+            try:
+                pos = 0
+                size = len(mm)
+                while pos < size:
+                    end = mm.rfind(b'\n', pos, pos + self.chunk_size) + 1
+                    if end <= pos:
+                        # no complete line in the chunk (or the last line has no line break)
+                        end = mm.find(b'\n', pos + self.chunk_size) + 1 or size
+                    yield self._parse(mm[pos:end])
+                    pos = end
+            finally:
+                mm.close()
+
+    @staticmethod
+    def _parse(data):
+        """
+        Parses the lines in data with numpy: the sensor types are looked up by the length, first and last
+        character of the first field and then compared, the numbers are converted by np.loadtxt. Chunks with
+        other lines than samples and the header (e.g. a line cut off when the writer was killed) are parsed line
+        by line.
+        :return: (sensor ids, values) arrays
+        """
+        last = data.rfind(b'\n') + 1
+        if last < len(data):
+            # the last line has no line break, it may have been cut off
+            ids, values = ReplaySource._parse(data[:last])
+            tail_ids, tail_values = ReplaySource._parse_lines(data[last:])
+            ids.extend(tail_ids)
+            values.extend(tail_values)
+            return ids, values
+        if not data:
+            return array('B'), array('d')
+
+        buf = np.frombuffer(data, dtype=np.uint8)
+        ends = np.flatnonzero(buf == NEWLINE)
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        commas = np.flatnonzero(buf == COMMA)
+        first_comma = np.searchsorted(commas, starts)
+        if not (np.searchsorted(commas, ends) - first_comma == 4).all():
+            return ReplaySource._parse_lines(data)
+        name_ends = commas[first_comma]
+        keys = (name_ends - starts) << 16 | buf[starts].astype(np.int64) << 8 | buf[name_ends - 1]
+        positions = np.minimum(np.searchsorted(NAME_KEYS, keys), len(NAME_KEYS) - 1)
+        known = NAME_KEYS[positions] == keys
+        ids = NAME_IDS[positions]
+        for sensor in np.unique(ids[known]).tolist():
+            rows = known & (ids == sensor)
+            for i, char in enumerate(bytearray(SENSOR_NAMES[sensor].encode('ascii'))):
+                rows &= buf[np.minimum(starts + i, len(buf) - 1)] == char
+            known &= rows | (ids != sensor)
+
+        # only the header may be something else than a sample
+        header = 0
+        if not known[0]:
+            header = 1
+        if not known[header:].all():
+            return ReplaySource._parse_lines(data)
+        if header == len(ends):
+            return array('B'), array('d')
+        try:
+            values = np.loadtxt(io.BytesIO(data), delimiter=',', usecols=(1, 2, 3, 4), skiprows=header, ndmin=2)
+        except ValueError:
+            return ReplaySource._parse_lines(data)
+        return array('B', ids[header:].astype(np.uint8).tobytes()), array('d', values.tobytes())
+
+    @staticmethod
+    def _parse_lines(data):
+        ids = array('B')
+        values = array('d')
+        for line in data.split(b'\n'):
+            comps = line.split(b',')
+            if len(comps) != 5:
+                continue
+            sensor = SENSOR_IDS.get(comps[0])
+            if sensor is None:
+                # header or unknown sensor type
+                continue
+            try:
+                values.extend((float(comps[1]), float(comps[2]), float(comps[3]), float(comps[4])))
+            except ValueError:
+                continue
+            ids.append(sensor)
+        return ids, values
+
+    def _load(self):
+        ids = array('B')
+        values = array('d')
+        for chunk_ids, chunk_values in self._chunks():
+            ids.extend(chunk_ids)
+            values.extend(chunk_values)
+        self.__loaded = (ids, values)
+
+    def start_reading(self, start_ms=None):
+        """
+        Replays until a listener returns False, stop() is called or the recording ends
+        :param start_ms: Clock time (ms) at which to start, like for SensorReader. The samples keep their
+        recorded times. None starts right away.
+        """
+        if self.preload and self.__loaded is None:
+            self._load()
+
+        self.__stopped = False
+        self.read_samples = 0
+        if start_ms is not None:
+            self._wait_until(start_ms)
+            self.started_ms = start_ms
+        else:
+            self.started_ms = self.current_millis_frac()
+
+        deliver = self._deliver_function()
+
+        block = self.block
+        size = block.size
+        speed = self.speed
+        clock = time.time
+        sleep = time.sleep
+        started = clock()
+        first_ms = None
+
+        for ids, values in self._chunks():
+            count = len(ids)
+            if first_ms is None and count > 0:
+                first_ms = values[STRIDE - 1]
+            i = 0
+            while i < count:
+                j = min(i + size, count)
+                if speed:
+                    # wait for the next sample, then pass on all samples that are due by now
+                    due = started + (values[i * STRIDE + STRIDE - 1] - first_ms) / speed / 1000.0
+                    now = clock()
+                    if due > now:
+                        sleep(due - now)
+                        now = clock()
+                    limit_ms = first_ms + (now - started) * speed * 1000.0
+                    k = i + 1
+                    while k < j and values[k * STRIDE + STRIDE - 1] <= limit_ms:
+                        k += 1
+                    j = k
+
+                n = j - i
+                block.sensor_ids[0:n] = ids[i:j]
+                block.values[0:n * STRIDE] = values[i * STRIDE:j * STRIDE]
+                block.count = n
+                self.read_samples += n
+                i = j
+                if not deliver(block):
+                    self.__stopped = True
+                if self.__stopped:
+                    break
+            if self.__stopped:
+                break
+
+        elapsed = clock() - started
+        if elapsed > 0:
+            self.samples_per_sec = self.read_samples / elapsed
+        print('Replayed ' + str(self.read_samples) + ' samples (samples/sec: ' + str(self.samples_per_sec) + ')')
+        self.__stopped = True
+
+    @staticmethod
+    def current_millis_frac():
+        return time.time() * 1000
+
+    def stop(self):
+        self.__stopped = True
+
+    def is_stopped(self):
+        return self.__stopped
@@ -0,0 +1,74 @@
+from array import array
+
+from data_point import DataPoint
+
+# Sensor ids used on the acquisition hot path instead of sensor type strings
+ACC = 0
+GYR = 1
+COMP = 2
+# A gap marker of a sensor has the id GAP + sensor id
+GAP = 3
+# Markers of degradations applied by flow control (see flow_control)
+DROPPED = 6
+DECIMATED = 7
+RATE = 8
+# Alert of the anomaly detector (see anomaly_detector)
+ALERT = 9
+
+SENSOR_NAMES = ('acc', 'gyr', 'comp', 'gap_acc', 'gap_gyr', 'gap_comp', 'dropped', 'decimated', 'rate', 'alert')
+
+# Number of values stored per sample: x, y, z, time
+STRIDE = 4
+
+
+class SampleBlock:
+    """
+    Fixed-size block of samples stored in flat arrays. The producer writes into a preallocated block
+    and passes it to block-aware listeners once it is full, so no object is created per sample.
+    """
+
+    def __init__(self, size=64):
+        """
+
+        :param size: Maximum number of samples in the block
+        """
+        self.size = size
+        self.count = 0
+        self.sensor_ids = array('B', bytes(size))
+        # x, y, z, time of sample i start at index i * STRIDE
+        self.values = array('d', bytes(8 * STRIDE * size))
+
+    @staticmethod
+    def from_arrays(sensor_ids, values):
+        """
+        Creates a full block that uses the given arrays instead of preallocated ones
+        :param sensor_ids: array('B') of the sensor ids
+        :param values: array('d') with STRIDE values per sample
+        """
+        block = SampleBlock.__new__(SampleBlock)
+        block.size = block.count = len(sensor_ids)
+        block.sensor_ids = sensor_ids
+        block.values = values
+        return block
+
+    def snapshot(self):
+        """
+        :return: Compact copy of the filled part of the block, e.g. to pass it to another process
+        """
+        return SampleBlock.from_arrays(self.sensor_ids[:self.count], self.values[:self.count * STRIDE])
+
+    def data_point(self, i):
+        values = self.values
+        offset = i * STRIDE
+        return DataPoint(values[offset], values[offset + 1], values[offset + 2], values[offset + 3],
+                         SENSOR_NAMES[self.sensor_ids[i]])
+
+    def data_points(self):
+        """
+        Generator of DataPoints for all samples in the block
+        """
+        for i in range(self.count):
+            yield self.data_point(i)
+
+    def __len__(self):
+        return self.count
@@ -1,111 +1,358 @@
-import random
+import gc
+import itertools
 import time
-from adxl345.i2c import ADXL345
-from data_point import DataPoint
-from hmc5883l.HMC5883L import HMC5883L
-from itg3200.ITG3200 import ITG3200
+from acquisition_profile import load_profile
+from bus_guard import DeviceGuard
+from sample_block import SampleBlock, ACC, GYR, COMP, GAP, STRIDE
+from source_base import SourceBase
 
+# Order in which the sensors are read, repeated for the whole recording
+ACC_SCHEDULE = (ACC,)
+# Also reads from the other sensors: gyroscope at samples 0 and 11, compass at sample 6 of every 16
+FULL_SCHEDULE = (GYR, ACC, ACC, ACC, ACC, ACC, COMP, ACC, ACC, ACC, ACC, GYR, ACC, ACC, ACC, ACC)
 
-class SensorReader:
+# With manual_gc, a full collection is done every this many stats updates (seconds)
+FULL_GC_INTERVAL = 60
+
+# While the loop is paced, a block is passed on at least this often (ms), so the listeners (e.g. the flow
+# control checks) don't wait for a full block at a low rate
+PACED_FLUSH_MS = 100.0
+
+
+class SensorReader(SourceBase):
     """
     Reads data from accelerometer, gyroscope and compass
     """
 
-    def __init__(self):
+    def __init__(self, bus=None, schedule=None, block_size=None, manual_gc=False, profile=None, clock=time.time,
+                 paced=True):
+        """
+        Only the sensors in the schedule are imported, opened and configured (None for the others).
+        Devices on different buses are configured in parallel.
+
+        :param bus: Bus object shared by all sensors (e.g. a SimulatedBus). If None, the bus selected by the
+        profile's transport is used.
+        :param schedule: Sequence of sensor ids (see sample_block) that is read in a loop. None uses the profile's.
+        :param block_size: Number of samples that are passed to block-aware listeners at once. None uses the
+        profile's.
+        :param manual_gc: Disable the garbage collector while reading, so it can't pause the loop at random
+        samples. Young generations are then collected with the per-second stats update instead.
+        :param profile: AcquisitionProfile with the sensor settings. None uses the default profile.
+        :param clock: Function returning the current time in seconds, used for the sample times
+        :param paced: Pace the loop to the output data rates (see _update_pace), so a sample isn't read several
+        times. False reads as fast as the bus allows (e.g. to benchmark the loop), unless set_accelerometer_rate
+        lowered the rate below the profile's.
+        """
+        if profile is None:
+            profile = load_profile()
+        if bus is None and profile.transport == 'simulated':
+            from sim_bus import SimulatedBus
+            bus = SimulatedBus()
+
+        SourceBase.__init__(self, clock)
+        self.profile = profile
         self.__stopped = True
+        self.manual_gc = manual_gc
         self.samples_per_sec = 0
-        self.accelerometer = ADXL345(alternate=True)
-        self.accelerometer.set_data_rate(800)
-        self.accelerometer.set_range(16, True)
-        self.gyroscope = ITG3200()
-        self.compass = HMC5883L()
+        self.read_samples = 0
+        self.schedule = tuple(profile.schedule if schedule is None else schedule)
+        self.block = SampleBlock(profile.block_size if block_size is None else block_size)
+
+        # current output data rate of the accelerometer, can be lowered while reading by set_accelerometer_rate
+        self.acc_rate = None
+        self.paced = paced
+        # time per iteration of the loop, 0 reads as fast as possible
+        self.__pace_ms = 0.0
+        self.accelerometer = None
+        self.gyroscope = None
+        self.compass = None
+        # functions that open and configure the used devices, grouped by the bus they are on
+        i2c_bus = ('bus', id(bus)) if bus is not None else ('i2c', profile.port)
+        device_inits = {}
+        if ACC in self.schedule:
+            if profile.acc['backend'] == 'spi':
+                acc_bus = ('spi', profile.acc['spi_bus'])
+            else:
+                acc_bus = i2c_bus
+            device_inits.setdefault(acc_bus, []).append(lambda: self._open_accelerometer(bus))
+        if GYR in self.schedule:
+            device_inits.setdefault(i2c_bus, []).append(lambda: self._open_gyroscope(bus))
+        if COMP in self.schedule:
+            device_inits.setdefault(i2c_bus, []).append(lambda: self._open_compass(bus))
+        _run_per_bus(list(device_inits.values()))
+
+        # I/O errors of a sensor only cost a few samples instead of the whole run
+        self.acc_guard = DeviceGuard('acc', init=self._reinit_accelerometer if self.accelerometer else None,
+                                     clock=clock)
+        self.gyr_guard = DeviceGuard('gyr', init=self.gyroscope.default_init if self.gyroscope else None,
+                                     clock=clock)
+        self.comp_guard = DeviceGuard('comp', init=self.compass.configure if self.compass else None, clock=clock)
+        # indexed by sensor id
+        self.guards = (self.acc_guard, self.gyr_guard, self.comp_guard)
+        self.__readers = tuple(device.read_data_into if device else None
+                               for device in (self.accelerometer, self.gyroscope, self.compass))
+        self._update_pace()
+
+    def _open_accelerometer(self, bus):
+        acc = self.profile.acc
+        if acc['backend'] == 'spi':
+            from adxl345.spi import ADXL345
+            self.accelerometer = ADXL345(acc['spi_bus'], acc['spi_device'])
+        else:
+            from adxl345.i2c import ADXL345
+            self.accelerometer = ADXL345(alternate=acc['alternate_address'], port=self.profile.port, bus=bus)
+        self._configure_accelerometer()
+
+    def _open_gyroscope(self, bus):
+        from itg3200.ITG3200 import ITG3200
+        gyr = self.profile.gyr
+        self.gyroscope = ITG3200(bus_nr=self.profile.port, addr=gyr['address'], bus=bus, lpf=gyr['lpf'],
+                                 div=gyr['divider'])
 
-    def set_sensor_listener(self, listener):
-        self.listener = listener
+    def _open_compass(self, bus):
+        from hmc5883l.HMC5883L import HMC5883L
+        comp = self.profile.comp
+        self.compass = HMC5883L(port=self.profile.port, address=comp['address'], gauss=comp['gauss'],
+                                declination=tuple(comp['declination']), bus=bus, rate=comp['rate'],
+                                samples=comp['samples'])
 
-    def start_reading(self):
+    def _configure_accelerometer(self):
+        acc = self.profile.acc
+        self.acc_rate = self.accelerometer.set_data_rate(self.acc_rate or acc['rate'], acc['low_power'])
+        self.accelerometer.set_range(acc['range'], acc['full_resolution'])
+
+    def _reinit_accelerometer(self):
+        self._configure_accelerometer()
         self.accelerometer.power_on()
 
+    def set_accelerometer_rate(self, hz):
+        """
+        Changes the output data rate of the accelerometer while reading, e.g. by FlowControl when a consumer
+        falls behind. Called by listeners between blocks. The loop is paced to the new rate.
+        :param hz: Requested rate, the next lower supported rate is used
+        :return: The rate now in use, None if there is no accelerometer or it is unavailable
+        """
+        if self.accelerometer is None:
+            return None
+        rate = self.acc_guard.call(self.accelerometer.set_data_rate, hz, self.profile.acc['low_power'])
+        if rate is None:
+            return None
+        self.acc_rate = rate
+        self._update_pace()
+        return rate
+
+    def _update_pace(self):
+        """
+        Paces the loop so the accelerometer (without it, the sensor that is read most often) is read once per
+        period of its output data rate, the other sensors of the schedule proportionally. The schedule sets
+        how often the others are read relative to it.
+        """
+        if ACC in self.schedule and self.acc_rate:
+            if not self.paced and self.acc_rate >= (self.profile.acc_rate or 0):
+                self.__pace_ms = 0.0
+                return
+            sensor = ACC
+            period_ms = 1000.0 / self.acc_rate
+        elif not self.paced:
+            self.__pace_ms = 0.0
+            return
+        else:
+            sensor = max(sorted(set(self.schedule)), key=self.schedule.count)
+            period_ms = {ACC: self.profile.acc_period_ms, GYR: self.profile.gyr_period_ms,
+                         COMP: self.profile.comp_period_ms}[sensor] or 0.0
+        # the schedule may contain other sensors between two reads of this one
+        self.__pace_ms = period_ms * self.schedule.count(sensor) / len(self.schedule)
+
+    def start_reading(self, start_ms=None):
+        """
+        Reads until a listener returns False or stop() is called
+        :param start_ms: Clock time (ms) at which to start, e.g. an epoch shared by several nodes (see time_sync).
+        Sample times are relative to it. None starts right away.
+        """
+        if self.accelerometer is not None:
+            self.acc_guard.call(self.accelerometer.power_on)
+
         self.__stopped = False
-        self.last_sec = self.current_sec()
-        self.__samples_in_sec = 0
-        self.started_ms = self.current_millis_frac()
         self.read_samples = 0
+        if start_ms is not None:
+            self._wait_until(start_ms)
+            self.started_ms = start_ms
+        else:
+            self.started_ms = self.clock() * 1000.0
+        self.__stats_ms = 0.0
+        self.__stats_samples = 0
+        self.__stats_updates = 0
 
-        while not self.__stopped:
+        gc_was_enabled = gc.isenabled()
+        if self.manual_gc:
+            # objects that exist now (modules, drivers, ...) don't need to be scanned again
+            gc.collect()
+            gc.freeze()
+            gc.disable()
 
-            sensor = self.__sensor_to_read()
-            if sensor == 'gyr':
-                reading = self.__read_gyroscope()
-            elif sensor == 'comp':
-                reading = self.__read_compass()
-            else:
-                reading = self.__read_accelerometer()
-
-            curr_sec = self.current_sec()
-            if self.last_sec != curr_sec:
-                secs = curr_sec - self.last_sec
-                print('Samples read: ' + str(
-                    self.read_samples) + ' (samples/sec: ' +
-                      str(self.samples_per_sec) + ")")
-                self.samples_per_sec = self.__samples_in_sec / secs
-                self.__samples_in_sec = 0
-                self.last_sec = curr_sec
-
-            self.__samples_in_sec += 1
-
-            self.read_samples += 1
-
-            # pass to consumer
-            if not self.listener.on_sensor_data_changed(reading):
-                self.__stopped = True
-                print("Stopping sensor reader")
-
-    def __read_accelerometer(self):
-        acc_reading = DataPoint()
-        acc_reading.sensor_type = 'acc'
-        acc = self.accelerometer.read_data()
-        acc_reading.x = acc[0]
-        acc_reading.y = acc[1]
-        acc_reading.z = acc[2]
-        acc_reading.time = self.current_millis_frac() - self.started_ms
-        return acc_reading
-
-    def __read_gyroscope(self):
-        gyr_reading = DataPoint()
-        gyr_reading.sensor_type = 'gyr'
-        gyr = self.gyroscope.read_data()
-        gyr_reading.x = gyr[0]
-        gyr_reading.y = gyr[1]
-        gyr_reading.z = gyr[2]
-        gyr_reading.time = self.current_millis_frac() - self.started_ms
-        return gyr_reading
-
-    def __read_compass(self):
-        comp_reading = DataPoint()
-        comp_reading.sensor_type = 'comp'
-        comp = self.compass.read_data()
-        comp_reading.x = comp[0]
-        comp_reading.y = comp[1]
-        comp_reading.z = comp[2]
-        comp_reading.time = self.current_millis_frac() - self.started_ms
-        return comp_reading
-
-    def __sensor_to_read(self):
-        """
-
-        :return: Which sensor to read from in the current iteration (based on read_samples)
-        """
-        return 'acc'
-
-        # TODO uncomment to also read from other sensors, if needed
-        # remainder = self.read_samples % 16
-        # if remainder == 0 or remainder == 11:
-        #     return 'gyr'
-        # elif remainder == 6:
-        #     return 'comp'
-        # else:
-        #     return 'acc'
+        try:
+            deliver = self._deliver_function()
+
+            # Hot loop: everything is bound to locals and samples are written into the preallocated block,
+            # so an iteration does a bus read, one clock call and a few array stores. The stop flag is only
+            # checked when the block is passed on or a sensor is unavailable.
+            block = self.block
+            ids = block.sensor_ids
+            values = block.values
+            size = block.size
+            readers = self.__readers
+            guards = self.guards
+            next_sensor = itertools.cycle(self.schedule).__next__
+            clock = self.clock
+            started_ms = self.started_ms
+            next_stats_ms = 1000.0
+            pace_ms = self.__pace_ms
+            next_read_ms = 0.0
+            next_flush_ms = PACED_FLUSH_MS
+            # stats update or, while paced, every iteration
+            next_event_ms = 0.0 if pace_ms else next_stats_ms
+            sleep = time.sleep
+            n = 0
+
+            while True:
+                sensor = next_sensor()
+                guard = guards[sensor]
+                offset = n * STRIDE
+                if guard.ready:
+                    try:
+                        readers[sensor](values, offset)
+                    except IOError:
+                        available = guard.retry(readers[sensor], values, offset) is not None
+                    else:
+                        guard.reads += 1
+                        available = True
+                else:
+                    available = guard.call(readers[sensor], values, offset) is not None
+
+                t = clock() * 1000.0 - started_ms
+                if available:
+                    values[offset + 3] = t
+                    ids[n] = sensor
+                    n += 1
+                    if guard.gap_pending:
+                        if n == size:
+                            n = self.__flush(deliver, n)
+                        n = self.__put_gap(guard, sensor, n, t)
+                    if n == size:
+                        n = self.__flush(deliver, n)
+                        if self.__stopped:
+                            break
+                        next_flush_ms = t + PACED_FLUSH_MS
+                        # the listener may have changed the rate
+                        pace_ms = self.__pace_ms
+                        next_event_ms = 0.0 if pace_ms else next_stats_ms
+                elif self.__stopped:
+                    # sensor is unavailable, the gap is reported once it answers again
+                    break
+                else:
+                    self.__wait_for_devices()
+
+                if t >= next_event_ms:
+                    if t >= next_stats_ms:
+                        next_stats_ms = self.__update_stats(t, n)
+                    if pace_ms and n and t >= next_flush_ms:
+                        n = self.__flush(deliver, n)
+                        if self.__stopped:
+                            break
+                        next_flush_ms = t + PACED_FLUSH_MS
+                        pace_ms = self.__pace_ms
+                    if pace_ms:
+                        next_read_ms += pace_ms
+                        if next_read_ms > t:
+                            sleep((next_read_ms - t) / 1000.0)
+                        elif t - next_read_ms > pace_ms:
+                            # more than a period behind schedule (not just an overshooting sleep), continue from now
+                            # instead of catching up with a burst
+                            next_read_ms = t
+                    next_event_ms = 0.0 if pace_ms else next_stats_ms
+
+            if n > 0:
+                self.__flush(deliver, n)
+        finally:
+            # also when a listener or a driver raises
+            if self.manual_gc:
+                gc.unfreeze()
+                if gc_was_enabled:
+                    gc.enable()
+
+    def __wait_for_devices(self):
+        """
+        Sleeps until the earliest retry if none of the scheduled sensors is ready, instead of spinning through
+        the schedule while all of them back off
+        """
+        retry_at = None
+        for sensor in set(self.schedule):
+            guard = self.guards[sensor]
+            if guard.ready:
+                return
+            if guard.retry_at is not None and (retry_at is None or guard.retry_at < retry_at):
+                retry_at = guard.retry_at
+        if retry_at is not None:
+            delay = retry_at - self.clock()
+            if delay > 0:
+                time.sleep(delay)
+
+    def __flush(self, deliver, n):
+        """
+        Passes the first n samples of the block to the listener
+        :return: Number of samples left in the block (always 0)
+        """
+        self.block.count = n
+        self.read_samples += n
+        if not deliver(self.block) and not self.__stopped:
+            self.__stopped = True
+            print("Stopping sensor reader")
+        return 0
+
+    def __put_gap(self, guard, sensor, n, t):
+        """
+        Writes a gap marker for a sensor that was unavailable into the block.
+        x is the length of the gap (ms), y the number of I/O errors during the gap.
+        :return: New number of samples in the block
+        """
+        started, errors = guard.take_gap()
+        values = self.block.values
+        offset = n * STRIDE
+        values[offset] = t + self.started_ms - started * 1000
+        values[offset + 1] = errors
+        values[offset + 2] = 0.0
+        values[offset + 3] = t
+        self.block.sensor_ids[n] = GAP + sensor
+        return n + 1
+
+    def __update_stats(self, t, n):
+        """
+        Computes and prints the sampling rate. Called about once per second, not for every sample.
+        :return: Time (ms) of the next update
+        """
+        samples = self.read_samples + n
+        self.samples_per_sec = (samples - self.__stats_samples) * 1000.0 / (t - self.__stats_ms)
+        self.__stats_samples = samples
+        self.__stats_ms = t
+        print('Samples read: ' + str(samples) + ' (samples/sec: ' + str(self.samples_per_sec) + ")")
+        self.__print_bus_errors()
+        self.__stats_updates += 1
+        if self.manual_gc:
+            gc.collect(2 if self.__stats_updates % FULL_GC_INTERVAL == 0 else 1)
+        return t + 1000.0
+
+    def __print_bus_errors(self):
+        for guard in self.guards:
+            if guard.errors:
+                print('  ' + guard.name + ': ' + str(guard.errors) + ' bus errors (error rate: ' +
+                      str(round(guard.error_rate(), 4)) + ', reinits: ' + str(guard.reinits) + ')')
+
+    def bus_stats(self):
+        """
+
+        :return: Error metrics per sensor name
+        """
+        return dict((guard.name, guard.stats()) for guard in self.guards)
 
     @staticmethod
     def current_millis_frac():
@@ -119,3 +366,32 @@ class SensorReader:
 
     def is_stopped(self):
         return self.__stopped
+
+
+def _run_per_bus(groups):
+    """
+    Runs groups of functions in parallel, the functions of a group one after another. Used to configure
+    devices on different buses at the same time, while transfers on one bus stay sequential.
+    Exceptions are re-raised in the calling thread.
+    """
+    errors = []
+
+    def run(functions):
+        try:
+            for function in functions:
+                function()
+        except Exception as e:
+            errors.append(e)
+
+    threads = []
+    if len(groups) > 1:
+        import threading
+        threads = [threading.Thread(target=run, args=(functions,)) for functions in groups[1:]]
+    for thread in threads:
+        thread.start()
+    if groups:
+        run(groups[0])
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,78 @@
+import random
+
+
+class SimulatedBus:
+    """
+    In-memory stand-in for smbus.SMBus with fault injection. Every device address gets its own 256 byte
+    register file. Can be passed to the drivers (bus=...) to run the pipeline without a board.
+    """
+
+    def __init__(self, error_rate=0.0, seed=None):
+        """
+
+        :param error_rate: Probability that any bus operation raises an IOError
+        :param seed: Seed for the random generator used by error_rate
+        """
+        self.registers = {}
+        self.error_rate = error_rate
+        self.operations = 0
+        self.__random = random.Random(seed)
+        self.__pending_faults = {}
+
+    def _device(self, address):
+        regs = self.registers.get(address)
+        if regs is None:
+            regs = self.registers[address] = [0] * 256
+        return regs
+
+    def set_registers(self, address, register, values):
+        """
+        Sets register contents, e.g. to simulate a measurement
+        """
+        regs = self._device(address)
+        for i, value in enumerate(values):
+            regs[(register + i) & 0xFF] = value & 0xFF
+
+    def inject_faults(self, count, address=None):
+        """
+        Makes the next count operations fail with an IOError
+        :param address: Only fail operations on this device address. None fails any operation.
+        """
+        self.__pending_faults[address] = self.__pending_faults.get(address, 0) + count
+
+    def brownout(self, address):
+        """
+        Simulates a power glitch of a single device: its configuration registers are lost
+        """
+        self.registers[address] = [0] * 256
+
+    def _check_fault(self, address):
+        self.operations += 1
+        for key in (address, None):
+            pending = self.__pending_faults.get(key, 0)
+            if pending > 0:
+                self.__pending_faults[key] = pending - 1
+                raise IOError(121, 'Remote I/O error (simulated)')
+        if self.error_rate > 0 and self.__random.random() < self.error_rate:
+            raise IOError(121, 'Remote I/O error (simulated)')
+
+    def read_byte_data(self, address, register):
+        self._check_fault(address)
+        return self._device(address)[register & 0xFF]
+
+    def read_word_data(self, address, register):
+        self._check_fault(address)
+        regs = self._device(address)
+        return regs[register & 0xFF] | (regs[(register + 1) & 0xFF] << 8)
+
+    def read_i2c_block_data(self, address, register, length=32):
+        self._check_fault(address)
+        regs = self._device(address)
+        return [regs[(register + i) & 0xFF] for i in range(length)]
+
+    def write_byte_data(self, address, register, value):
+        self._check_fault(address)
+        self._device(address)[register & 0xFF] = value & 0xFF
+
+    def close(self):
+        pass
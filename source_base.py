@@ -0,0 +1,51 @@
+import time
+
+
+class SourceBase:
+    """
+    Listener handling and start time of a sample source (SensorReader, ReplaySource).
+    Subclasses implement start_reading.
+    """
+
+    def __init__(self, clock=time.time):
+        """
+
+        :param clock: Function returning the current time in seconds
+        """
+        self.clock = clock
+        self.listener = None
+
+    def set_sensor_listener(self, listener):
+        """
+        :param listener: Receives the samples. If it has a method on_sensor_block(block), it gets whole
+        SampleBlocks, otherwise on_sensor_data_changed(data_point) is called for every sample.
+        Both return False to stop reading.
+        """
+        self.listener = listener
+
+    def _deliver_function(self):
+        """
+        :return: Function that passes a SampleBlock to the listener and returns False to stop reading
+        """
+        if hasattr(self.listener, 'on_sensor_block'):
+            return self.listener.on_sensor_block
+        return self.__deliver_data_points
+
+    def __deliver_data_points(self, block):
+        on_sensor_data_changed = self.listener.on_sensor_data_changed
+        for i in range(block.count):
+            if not on_sensor_data_changed(block.data_point(i)):
+                return False
+        return True
+
+    def _wait_until(self, start_ms):
+        """
+        Returns at the given clock time (ms)
+        """
+        # sleeps most of the time and spins for the last milliseconds, sleep() may overshoot
+        while True:
+            remaining_ms = start_ms - self.clock() * 1000.0
+            if remaining_ms <= 0:
+                return
+            if remaining_ms > 2.0:
+                time.sleep((remaining_ms - 2.0) / 1000.0)
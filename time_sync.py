@@ -0,0 +1,380 @@
+"""
+Time synchronization of several nodes (Pis) that record at the same time.
+
+One machine runs a Coordinator, whose clock is the reference. Every node measures the offset of its clock
+to the coordinator's with NTP-style exchanges over UDP: the node sends its time t1, the coordinator
+answers with its receive and send times t2 and t3, and the node notes the arrival time t4. Then
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2    (coordinator clock - node clock)
+    delay = (t4 - t1) - (t3 - t2)
+
+A sync round does several exchanges and keeps the one with the smallest delay, as it is the least
+affected by queuing. A line fitted through the rounds gives the offset and the drift of the node's clock.
+
+Once all expected nodes have registered, the coordinator announces an epoch (in its clock) at which all
+nodes start recording. While recording, a node keeps doing sync rounds and writes them to a metadata file
+(see SyncClient.write_metadata), which merge() uses to map the sample times of every node onto the
+coordinator's clock.
+"""
+
+import json
+import os
+import socket
+import time
+from bisect import bisect_right
+from heapq import heappop, heappush, merge as merge_sorted
+
+DEFAULT_PORT = 5005
+# Number of recent rounds that the live estimate is fitted to, the drift changes with temperature
+FIT_ROUNDS = 32
+# Rounds with more than this times the smallest delay are not used for the fit
+MAX_DELAY_RATIO = 2.0
+# How much older (ms) a sample of a recording may be than samples before it, e.g. with the 'decimate' flow
+# control policy, whose filters delay the samples of every sensor by a different time
+REORDER_MS = 2000.0
+
+
+class ClockModel:
+    """
+    Offset of a node's clock to the coordinator's: offset(local) = offset_ms + drift * (local - reference_ms)
+    """
+
+    def __init__(self, reference_ms=0.0, offset_ms=0.0, drift=0.0):
+        self.reference_ms = reference_ms
+        self.offset_ms = offset_ms
+        self.drift = drift
+
+    @staticmethod
+    def fit(rounds):
+        """
+        Least squares line through the offsets of sync rounds
+        :param rounds: Sequence of (local time, offset, delay) in ms
+        """
+        rounds = usable_rounds(rounds)
+        if not rounds:
+            return ClockModel()
+        n = len(rounds)
+        reference_ms = sum(r[0] for r in rounds) / n
+        offset_ms = sum(r[1] for r in rounds) / n
+        if n == 1:
+            return ClockModel(reference_ms, offset_ms)
+        sxx = sum((r[0] - reference_ms) ** 2 for r in rounds)
+        sxy = sum((r[0] - reference_ms) * (r[1] - offset_ms) for r in rounds)
+        return ClockModel(reference_ms, offset_ms, sxy / sxx if sxx > 0 else 0.0)
+
+    def offset(self, local_ms):
+        return self.offset_ms + self.drift * (local_ms - self.reference_ms)
+
+    def to_coordinator(self, local_ms):
+        return local_ms + self.offset(local_ms)
+
+    def to_local(self, coordinator_ms):
+        return (coordinator_ms - self.offset_ms + self.drift * self.reference_ms) / (1.0 + self.drift)
+
+
+def usable_rounds(rounds):
+    """
+    :return: The rounds whose delay is at most MAX_DELAY_RATIO times the smallest one
+    """
+    if not rounds:
+        return []
+    # at least 0.1 ms, on loopback the smallest delay can be a few microseconds
+    max_delay = max(min(r[2] for r in rounds), 0.1) * MAX_DELAY_RATIO
+    return [r for r in rounds if r[2] <= max_delay]
+
+
+class Coordinator:
+    """
+    Reference clock and start signal for the nodes. Answers time requests and announces the epoch.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, nodes=1, lead=2.0, host='', clock=time.time):
+        """
+
+        :param port: UDP port, 0 picks a free one (see self.port)
+        :param nodes: Number of nodes that have to register before the epoch is announced
+        :param lead: Seconds between the announcement and the epoch, so all nodes can sync and get ready
+        :param clock: Function returning the current time in seconds
+        """
+        self.expected = nodes
+        self.lead_ms = lead * 1000.0
+        self.clock = clock
+        self.nodes = {}
+        self.epoch_ms = None
+        self.__stopped = False
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.bind((host, port))
+        self.__sock.settimeout(0.5)
+        self.port = self.__sock.getsockname()[1]
+
+    def serve(self):
+        """
+        Answers requests until stop() is called
+        """
+        sock = self.__sock
+        clock = self.clock
+        while not self.__stopped:
+            try:
+                data, address = sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            t2 = clock() * 1000.0
+            comps = data.decode('ascii', 'replace').split(',')
+            if comps[0] == 'ping' and len(comps) == 3:
+                # t1 is passed back as received
+                reply = 'pong,' + comps[1] + ',' + comps[2] + ',' + repr(t2) + ','
+                sock.sendto((reply + repr(clock() * 1000.0)).encode('ascii'), address)
+            elif comps[0] == 'hello' and len(comps) == 2:
+                sock.sendto(self.__register(comps[1], address).encode('ascii'), address)
+
+    def __register(self, name, address):
+        if name not in self.nodes:
+            print('Node ' + name + ' registered from ' + address[0] + ':' + str(address[1]) + ' (' +
+                  str(len(self.nodes) + 1) + '/' + str(self.expected) + ')')
+        self.nodes[name] = address
+        if self.epoch_ms is None and len(self.nodes) >= self.expected:
+            self.epoch_ms = self.clock() * 1000.0 + self.lead_ms
+            print('Recording starts at ' + repr(self.epoch_ms))
+        if self.epoch_ms is None:
+            return 'wait,' + str(len(self.nodes)) + ',' + str(self.expected)
+        return 'epoch,' + repr(self.epoch_ms)
+
+    def stop(self):
+        self.__stopped = True
+
+    def close(self):
+        self.__sock.close()
+
+
+class SyncClient:
+    """
+    Node side: estimates the offset and drift to the coordinator's clock and waits for the epoch
+    """
+
+    def __init__(self, coordinator, name, clock=time.time, exchanges=8, timeout=0.2):
+        """
+
+        :param coordinator: (host, port) of the Coordinator
+        :param name: Name of the node, unique among the nodes
+        :param clock: Function returning the current time in seconds, the clock of the sample times
+        :param exchanges: Number of exchanges per sync round
+        :param timeout: Seconds to wait for a reply
+        """
+        self.coordinator = coordinator
+        self.name = name
+        self.clock = clock
+        self.exchanges = exchanges
+        # (local time, offset, delay) in ms of every round
+        self.rounds = []
+        self.model = ClockModel()
+        self.__seq = 0
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.settimeout(timeout)
+
+    def __exchange(self):
+        """
+        :return: (local time, offset, delay) in ms, or None if the coordinator didn't answer in time
+        """
+        self.__seq += 1
+        seq = str(self.__seq)
+        t1 = self.clock() * 1000.0
+        self.__sock.sendto(('ping,' + seq + ',' + repr(t1)).encode('ascii'), self.coordinator)
+        while True:
+            try:
+                data = self.__sock.recv(512)
+            except socket.timeout:
+                return None
+            t4 = self.clock() * 1000.0
+            comps = data.decode('ascii', 'replace').split(',')
+            # replies to earlier requests that timed out are skipped
+            if comps[0] == 'pong' and len(comps) == 5 and comps[1] == seq:
+                break
+        t2 = float(comps[3])
+        t3 = float(comps[4])
+        offset = ((t2 - t1) + (t3 - t4)) / 2.0
+        delay = (t4 - t1) - (t3 - t2)
+        return (t1 + t4) / 2.0, offset, delay
+
+    def sync_round(self):
+        """
+        Does a round of exchanges and updates the estimate
+        :return: (local time, offset, delay) in ms of the exchange with the smallest delay, None if none succeeded
+        """
+        best = None
+        for i in range(self.exchanges):
+            result = self.__exchange()
+            if result is not None and (best is None or result[2] < best[2]):
+                best = result
+        if best is None:
+            print('No reply from the coordinator ' + self.coordinator[0] + ':' + str(self.coordinator[1]))
+            return None
+        self.rounds.append(best)
+        self.model = ClockModel.fit(self.rounds[-FIT_ROUNDS:])
+        return best
+
+    def wait_for_epoch(self, rounds=5, interval=0.1):
+        """
+        Registers with the coordinator, syncs and waits until the coordinator announces the epoch
+        :param rounds: Sync rounds before registering, more rounds give a better initial estimate
+        :return: The epoch in the coordinator's clock (ms)
+        """
+        for i in range(rounds):
+            self.sync_round()
+            time.sleep(interval)
+        while True:
+            self.__sock.sendto(('hello,' + self.name).encode('ascii'), self.coordinator)
+            try:
+                comps = self.__sock.recv(512).decode('ascii', 'replace').split(',')
+            except socket.timeout:
+                continue
+            if comps[0] == 'epoch' and len(comps) == 2:
+                return float(comps[1])
+            # keeps the estimate up to date while the other nodes register
+            self.sync_round()
+            time.sleep(interval)
+
+    def local_time(self, coordinator_ms):
+        """
+        :return: Time of the local clock (ms) that corresponds to a time of the coordinator's clock
+        """
+        return self.model.to_local(coordinator_ms)
+
+    def write_metadata(self, path, epoch_ms, local_start_ms):
+        """
+        Writes the clock correction of a recording, replacing the file atomically
+        :param epoch_ms: Epoch announced by the coordinator
+        :param local_start_ms: Local clock time that the sample times of the recording are relative to
+        (SensorReader.started_ms)
+        """
+        metadata = {
+            'node': self.name,
+            'epoch_ms': epoch_ms,
+            'local_start_ms': local_start_ms,
+            'reference_ms': self.model.reference_ms,
+            'offset_ms': self.model.offset_ms,
+            'drift_ppm': self.model.drift * 1e6,
+            'rounds': self.rounds,
+        }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.replace(path + '.tmp', path)
+
+    def run(self, path, epoch_ms, local_start_ms, interval=10.0):
+        """
+        Syncs every interval seconds while recording and updates the metadata file. Doesn't return, run it
+        in its own process.
+        """
+        while True:
+            self.write_metadata(path, epoch_ms, local_start_ms)
+            time.sleep(interval)
+            self.sync_round()
+
+    def close(self):
+        self.__sock.close()
+
+
+class SyncMetadata:
+    """
+    Clock correction of a recording, loaded from the file written by SyncClient.write_metadata
+    """
+
+    def __init__(self, path):
+        with open(path) as f:
+            metadata = json.load(f)
+        self.node = metadata['node']
+        self.epoch_ms = metadata['epoch_ms']
+        self.local_start_ms = metadata['local_start_ms']
+        rounds = sorted(usable_rounds([tuple(r) for r in metadata['rounds']]))
+        self.model = ClockModel.fit(rounds)
+        self.times = [r[0] for r in rounds]
+        self.offsets = [r[1] for r in rounds]
+
+    def offset(self, local_ms):
+        """
+        Offset at a local time, interpolated between the sync rounds (the drift isn't constant over long
+        recordings). Outside the rounds it is extrapolated with the fitted drift.
+        """
+        times = self.times
+        i = bisect_right(times, local_ms)
+        if i == 0 or i == len(times):
+            if not times:
+                return self.model.offset(local_ms)
+            j = 0 if i == 0 else len(times) - 1
+            return self.offsets[j] + self.model.drift * (local_ms - times[j])
+        t0 = times[i - 1]
+        t1 = times[i]
+        return self.offsets[i - 1] + (self.offsets[i] - self.offsets[i - 1]) * (local_ms - t0) / (t1 - t0)
+
+    def aligned_time(self, sample_ms):
+        """
+        :param sample_ms: Time of a sample in the recording (ms since local_start_ms)
+        :return: Time in ms since the epoch, in the coordinator's clock
+        """
+        local_ms = self.local_start_ms + sample_ms
+        return local_ms + self.offset(local_ms) - self.epoch_ms
+
+
+def _aligned_lines(recording_path, metadata):
+    """
+    Generator of (aligned time, node, line without the time) of the samples of a recording
+    """
+    with open(recording_path) as f:
+        f.readline()
+        for line in f:
+            comps = line.rstrip('\n').rsplit(',', 1)
+            if len(comps) != 2:
+                continue
+            try:
+                t = float(comps[1])
+            except ValueError:
+                continue
+            yield metadata.aligned_time(t), metadata.node, comps[0]
+
+
+def _reordered(stream, reorder_ms):
+    """
+    Generator of the items of a stream of (time, ...) in time order, if no item is more than reorder_ms older
+    than one before it. Items with the same time keep their order.
+    """
+    pending = []
+    latest = None
+    for sequence, item in enumerate(stream):
+        heappush(pending, (item[0], sequence, item))
+        if latest is None or item[0] > latest:
+            latest = item[0]
+        while pending[0][0] < latest - reorder_ms:
+            yield heappop(pending)[2]
+    while pending:
+        yield heappop(pending)[2]
+
+
+def merge(output_path, recordings, reorder_ms=REORDER_MS):
+    """
+    Merges the recordings of several nodes into one file ordered by the aligned times
+    :param recordings: Sequence of (recording path, metadata path)
+    :param reorder_ms: Samples of a recording that are up to this much older than samples before them are
+    put in order
+    :return: Number of merged samples
+    """
+    streams = [_reordered(_aligned_lines(path, SyncMetadata(metadata_path)), reorder_ms)
+               for path, metadata_path in recordings]
+    count = 0
+    with open(output_path, 'w') as f:
+        f.write("Node,Sensor type,x,y,z,time since epoch (ms)\n")
+        for t, node, sample in merge_sorted(*streams):
+            f.write(node + ',' + sample + ',' + ('%.3f' % t) + '\n')
+            count += 1
+    return count
+
+
+def parse_address(address):
+    """
+    :param address: 'host:port' or 'host'
+    :return: (host, port)
+    """
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, DEFAULT_PORT
+    if not port.isdigit():
+        raise ValueError("invalid address [" + address + "] expected host:port")
+    return host, int(port)
@@ -0,0 +1,115 @@
+import multiprocessing
+from multiprocessing import Queue
+from queue import Empty
+
+from sample_block import SampleBlock
+
+
+class WriterBase:
+    """
+    Queue between the producer and the consumer process of a writer, with the counters used by flow control.
+    Subclasses implement _write_sample.
+    """
+
+    def __init__(self, stop, queue_size=0):
+        """
+
+        :param stop: Shared flag of the writer's module, the consumer stops the producer by setting it
+        :param queue_size: Maximum number of queued items (samples or blocks), 0 is unbounded
+        """
+
+        # for multiprocessing
+        self.__buffer = Queue(queue_size)
+        self.__stop = stop
+        # items put by the producer, and items and samples written by the consumer, for flow control
+        self.__queued = 0
+        self.__dropped = 0
+        self.__consumed = multiprocessing.Value("q", 0)
+        self.__consumed_samples = multiprocessing.Value("q", 0)
+
+    def on_sensor_data_changed(self, data_point):
+        """
+        Passes data to the consumer (consumer/producer architecture). Runs on producer process.
+        :returns If the writer has been stopped
+        """
+
+        if self.__stop.value != 0:
+            return False
+        else:
+            self.__buffer.put(data_point)
+            self.__queued += 1
+            return True
+
+    def on_sensor_block(self, block):
+        """
+        Passes a whole SampleBlock to the consumer, which costs one queue transfer instead of one per sample.
+        Runs on producer process.
+        :returns If the writer has been stopped
+        """
+
+        if self.__stop.value != 0:
+            return False
+        else:
+            self.__buffer.put(block.snapshot())
+            self.__queued += 1
+            return True
+
+    def backlog(self):
+        """
+        Runs on producer process.
+        :return: Number of queued items (samples or blocks) that the consumer hasn't written yet
+        """
+        return self.__queued - self.__dropped - self.__consumed.value
+
+    def consumed_samples(self):
+        """
+        :return: Number of samples the consumer has written so far
+        """
+        return self.__consumed_samples.value
+
+    def drop_oldest(self):
+        """
+        Removes the oldest queued item to make room when the consumer falls behind. Runs on producer process.
+        :return: The removed item (DataPoint or SampleBlock), or None if nothing could be removed
+        """
+        try:
+            item = self.__buffer.get_nowait()
+        except Empty:
+            return None
+        self.__dropped += 1
+        return item
+
+    def close(self):
+        """
+        Lets the producer exit without waiting for queued items to reach the consumer, which may already be
+        terminated. Runs on producer process.
+        """
+        self.__buffer.cancel_join_thread()
+
+    def _write_sample(self, sample):
+        """
+        :param sample: Writes a DataPoint
+        """
+        raise NotImplementedError("This method should be implemented by subclasses")
+
+    def start_write_loop(self):
+        """
+        Starts consumer loop that writes data points. Runs on consumer process.
+        """
+
+        self.__stop.value = 0
+
+        while True:
+            # This obviously is a very naive implementation of the consumer (while loop instead of lock).
+            # However, this already achieves the maximum sampling rate because the I2C communication with
+            # the sensors is the bottleneck.
+            if not self.__buffer.empty():
+                item = self.__buffer.get()
+                if isinstance(item, SampleBlock):
+                    for data_point in item.data_points():
+                        self._write_sample(data_point)
+                    self.__consumed_samples.value += item.count
+                else:
+                    self._write_sample(item)
+                    self.__consumed_samples.value += 1
+                self.__consumed.value += 1